@@ -8,12 +8,11 @@ from discord.ext import commands
 from yt_dlp import DownloadError, YoutubeDL
 
 from utils.base import CadeElegy, BaseCog, BaseEmbed
-from utils.edit import edit
-from utils.useful import check, format_time, get_media, run_async, run_cmd, send_media
+from utils.edit import Step, edit
+from utils.useful import check, fit_media, format_time, get_media, run_async, run_cmd, send_media
 from utils.vars import v
 from utils.views import ChoiceView
 
-from io import BytesIO
 from os import listdir
 from os.path import isfile, join
 import mimetypes
@@ -21,7 +20,7 @@ import mimetypes
 from datetime import datetime, timezone
 
 class Media(BaseCog):
-    @run_async
+    @run_async(pool="download")
     def video_download(self, loop, msg, url: str, start, end, video_format: str = "audio",   ):
         def _create_yt_hook(progress_msg, loop):
             class _Hook:
@@ -81,15 +80,12 @@ class Media(BaseCog):
                 return f"\n{dl_error}"
             
             result_filename = [f for f in listdir(tmpdir) if isfile(join(tmpdir, f))][0]
-            result_bytes = BytesIO()
 
-            with open(f"{tmpdir}/{result_filename}", "rb") as f:
-                result_bytes.write(f.read())
-
-            result_bytes.seek(0)
+            # the open file can still be read after the folder is deleted, so it isn't copied into memory
+            result_file = open(f"{tmpdir}/{result_filename}", "rb")
             mime = mimetypes.guess_type(f"{tmpdir}/{result_filename}")[0]
 
-            return (result_bytes, result_filename, mime)
+            return (result_file, result_filename, mime)
         
 
     @commands.command(usage="(image)")
@@ -97,12 +93,14 @@ class Media(BaseCog):
         """lowers the quality of the given image"""
         processing = await ctx.send(v.BOT__PROCESSING_MSG())
 
-        # get an image from the user's message
-        res, error = await get_media(ctx, ["image"])
-        if error:
-            return await processing.edit(content=error)
+        async with self.client.jobs.job(ctx, processing):
+            # get an image from the user's message
+            res, error = await get_media(ctx, ["image"])
+            if error:
+                return await processing.edit(content=error)
 
-        result = await edit(res).jpeg()
+            result = await edit(res).jpeg()
+            result = await fit_media(ctx, processing, result)
 
         # send the created image
         await send_media(ctx, processing, result)
@@ -245,9 +243,10 @@ class Media(BaseCog):
 
             source = "-" if audio_type == "file" else stream_url
 
-            _, returncode = await run_cmd(
-                v.FF__IMGAUDIO(temp, source, length_given), audio_bytes
-            )
+            async with self.client.jobs.job(ctx, processing, status=""):
+                _, returncode = await run_cmd(
+                    v.FF__IMGAUDIO(temp, source, length_given), audio_bytes
+                )
 
             if returncode != 0:
                 return await processing.edit(embed=None, content=v.ERR__FFMPEG_ERROR)
@@ -286,29 +285,31 @@ class Media(BaseCog):
 
         processing = await ctx.send(v.BOT__PROCESSING_MSG())
 
-        # get either an image, gif, or video attachment
-        res, error = await get_media(ctx, ["image", "video", "gif"])
-        if error:
-            return await processing.edit(content=error)
-
-        # calculate "auto" sizes
-        if orig_size := edit(res).file.size:
-            match (width, height):
-                case (v.RESIZE__AUTO_SIZE, v.RESIZE__AUTO_SIZE):  # raise error if both are auto
-                    raise commands.MissingRequiredArgument(ctx.command.params["width"])
-                case (v.RESIZE__AUTO_SIZE, _):  # needs width
-                    new_height = int(height)
-                    hpercent = new_height / orig_size[1]
-                    new_width = round(orig_size[0] * hpercent)
-                case (_, v.RESIZE__AUTO_SIZE):  # needs height
-                    new_width = int(width)
-                    wpercent = new_width / orig_size[0]
-                    new_height = round(orig_size[1] * wpercent)
-                case (_, _):
-                    new_width = int(width)
-                    new_height = int(height)
-
-        result = await edit(res).resize((new_width, new_height))
+        async with self.client.jobs.job(ctx, processing):
+            # get either an image, gif, or video attachment
+            res, error = await get_media(ctx, ["image", "video", "gif"])
+            if error:
+                return await processing.edit(content=error)
+
+            # calculate "auto" sizes
+            if orig_size := edit(res).file.size:
+                match (width, height):
+                    case (v.RESIZE__AUTO_SIZE, v.RESIZE__AUTO_SIZE):  # raise error if both are auto
+                        raise commands.MissingRequiredArgument(ctx.command.params["width"])
+                    case (v.RESIZE__AUTO_SIZE, _):  # needs width
+                        new_height = int(height)
+                        hpercent = new_height / orig_size[1]
+                        new_width = round(orig_size[0] * hpercent)
+                    case (_, v.RESIZE__AUTO_SIZE):  # needs height
+                        new_width = int(width)
+                        wpercent = new_width / orig_size[0]
+                        new_height = round(orig_size[1] * wpercent)
+                    case (_, _):
+                        new_width = int(width)
+                        new_height = int(height)
+
+            result = await edit(res).resize((new_width, new_height))
+            result = await fit_media(ctx, processing, result)
 
         # send the resized attachment
         await send_media(ctx, processing, result)
@@ -318,11 +319,13 @@ class Media(BaseCog):
         """captions the specified gif or image in the style of iFunny's captions"""
         processing = await ctx.send(v.BOT__PROCESSING_MSG())
 
-        res, error = await get_media(ctx, ["image", "video", "gif"])
-        if error:
-            return await processing.edit(content=error)
+        async with self.client.jobs.job(ctx, processing):
+            res, error = await get_media(ctx, ["image", "video", "gif"])
+            if error:
+                return await processing.edit(content=error)
 
-        result = await edit(res).caption(text)
+            result = await edit(res).caption(text)
+            result = await fit_media(ctx, processing, result)
 
         await send_media(ctx, processing, result)
 
@@ -331,11 +334,13 @@ class Media(BaseCog):
         """removes the caption from the given attachment"""
         processing = await ctx.send(v.BOT__PROCESSING_MSG())
 
-        res, error = await get_media(ctx, ["image", "video", "gif"])
-        if error:
-            return await processing.edit(content=error)
+        async with self.client.jobs.job(ctx, processing):
+            res, error = await get_media(ctx, ["image", "video", "gif"])
+            if error:
+                return await processing.edit(content=error)
 
-        result = await edit(res).uncaption()
+            result = await edit(res).uncaption()
+            result = await fit_media(ctx, processing, result)
 
         await send_media(ctx, processing, result)
 
@@ -355,11 +360,13 @@ class Media(BaseCog):
 
         processing = await ctx.send(v.BOT__PROCESSING_MSG())
 
-        res, error = await get_media(ctx, ["video", "gif"])
-        if error:
-            return await processing.edit(content=error)
+        async with self.client.jobs.job(ctx, processing):
+            res, error = await get_media(ctx, ["video", "gif"])
+            if error:
+                return await processing.edit(content=error)
 
-        result = await edit(res).speed(amount)
+            result = await edit(res).speed(amount)
+            result = await fit_media(ctx, processing, result)
 
         await send_media(ctx, processing, result)
 
@@ -413,8 +420,12 @@ class Media(BaseCog):
             content=f"-# {v.EMJ__WAITING} downloading...", view=None
         )
 
-        loop = asyncio.get_running_loop()
-        result = await self.video_download(loop, msg, url, start, end, view.choice)
+        async with self.client.jobs.job(ctx, msg, status=f"-# {v.EMJ__WAITING} downloading..."):
+            loop = asyncio.get_running_loop()
+            result = await self.video_download(loop, msg, url, start, end, view.choice)
+
+            if type(result) is not str:
+                result = await fit_media(ctx, msg, result)
 
         if type(result) is str:
             return await msg.edit(content=v.ERR__VID_DL_ERROR(result))
@@ -426,11 +437,91 @@ class Media(BaseCog):
         """reverses a gif"""
         processing = await ctx.send(v.BOT__PROCESSING_MSG())
 
-        res, error = await get_media(ctx, ["gif"])
+        async with self.client.jobs.job(ctx, processing):
+            res, error = await get_media(ctx, ["gif"])
+            if error:
+                return await processing.edit(content=error)
+
+            result = await edit(res).reverse()
+            result = await fit_media(ctx, processing, result)
+
+        await send_media(ctx, processing, result)
+
+    def _parse_steps(self, text: str) -> tuple[list[Step], list[str], str | None]:
+        """turns something like "caption hi | speed 2" into edit steps and the media types they work on"""
+        steps = []
+        media_types = ["image", "video", "gif"]
+
+        parts = [part.strip() for part in text.split(v.CHAIN__SEPARATOR)]
+
+        if len(parts) > v.CHAIN__MAX_STEPS:
+            return [], [], v.ERR__TOO_MANY_EDITS
+
+        for part in parts:
+            name, _, args = part.partition(" ")
+            name, args = name.lower(), args.split()
+
+            match name, args:
+                case "caption", [_, *_]:
+                    steps.append(("caption", part.split(" ", 1)[1].strip()))
+                case "uncaption", []:
+                    steps.append(("uncaption",))
+                case "resize", [width, *height] if len(height) <= 1:
+                    # non-numbers are "auto"
+                    width, height = [
+                        int(x) if x.isnumeric() and x != "0" else None
+                        for x in (width, *(height or ["auto"]))
+                    ]
+
+                    if width is None and height is None:
+                        return [], [], v.ERR__FILE_INVALID_SIZE
+
+                    if any(x and x > 2000 for x in (width, height)):
+                        return [], [], v.ERR__FILE_MAX_SIZE
+
+                    steps.append(("resize", width, height))
+                case "speed", [*amount] if len(amount) <= 1:
+                    try:
+                        amount = float((amount or ["1.25"])[0].strip("x"))
+                    except ValueError:
+                        amount = 0
+
+                    if amount <= 0:
+                        return [], [], v.ERR__INVALID_MULTIPLIER
+
+                    steps.append(("speed", amount))
+                    media_types = [t for t in media_types if t in ("video", "gif")]
+                case "reverse", []:
+                    steps.append(("reverse",))
+                    media_types = [t for t in media_types if t == "gif"]
+                case "jpeg", []:
+                    steps.append(("jpeg",))
+                    media_types = [t for t in media_types if t == "image"]
+                case _:
+                    return [], [], v.ERR__INVALID_EDIT(part or v.CHAIN__SEPARATOR)
+
+        if not media_types:
+            return [], [], v.ERR__MIXED_EDITS
+
+        return steps, media_types, None
+
+    @commands.command(usage="[edit] *[args] | [edit] *[args]... (gif/image/video)")
+    async def chain(self, ctx: commands.Context, *, edits: str):
+        """does several edits in a row (like `caption hi | speed 2 | resize 300`) without losing quality between them"""
+        steps, media_types, error = self._parse_steps(edits)
+
         if error:
-            return await processing.edit(content=error)
+            return await ctx.send(error)
+
+        processing = await ctx.send(v.BOT__PROCESSING_MSG())
+
+        async with self.client.jobs.job(ctx, processing):
+            res, error = await get_media(ctx, media_types)
+            if error:
+                return await processing.edit(content=error)
 
-        result = await edit(res).reverse()
+            result = await edit(res).chain(steps)
+            result = await fit_media(ctx, processing, result)
 
         await send_media(ctx, processing, result)
 
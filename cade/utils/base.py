@@ -10,6 +10,8 @@ from logging import Logger
 from configparser import ConfigParser
 from lavalink import Client as LavaClient, DefaultPlayer
 
+from .jobs import JobScheduler
+from .web import WebClient
 from .vars import v
 
 
@@ -22,6 +24,8 @@ class CadeElegy(commands.Bot):
         self.log: Logger = None
         self.token: str = None
         self.lavalink: CadeLavalinkElegy = None
+        self.jobs: JobScheduler = None
+        self.web: WebClient = None
 
 
 class CadeLavalinkElegy(LavaClient):
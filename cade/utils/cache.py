@@ -0,0 +1,348 @@
+import asyncio
+import os
+import pickle
+from collections import OrderedDict
+from io import BytesIO
+from threading import Lock
+from time import monotonic, time
+from typing import Any, Awaitable, Callable, Hashable
+from uuid import uuid4
+
+from . import workers
+
+
+class SizedLRU:
+    """
+    least recently used cache that's limited by the total size of its values (not the count),
+    where values can also expire after `ttl` seconds
+    """
+
+    def __init__(
+        self, max_size: int, sizeof: Callable[[Any], int] = len, ttl: float = None
+    ):
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self.ttl = ttl
+
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+        # key -> (value, size, when it expires)
+        self._items: OrderedDict[Hashable, tuple[Any, int, float | None]] = OrderedDict()
+        self._lock = Lock()  # edits run in worker threads
+
+    def __contains__(self, key: Hashable):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def _drop_expired(self):
+        """removes every expired value (must hold the lock)"""
+        now = monotonic()
+
+        for key in [k for k, (_, _, expires) in self._items.items() if expires <= now]:
+            self.size -= self._items.pop(key)[1]
+
+    def get(self, key: Hashable, default=None):
+        """gets a value and marks it as recently used"""
+        with self._lock:
+            if key not in self._items:
+                self.misses += 1
+                return default
+
+            value, item_size, expires = self._items[key]
+
+            if expires is not None and expires <= monotonic():
+                del self._items[key]
+                self.size -= item_size
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            self._items.move_to_end(key)
+
+            return value
+
+    def set(self, key: Hashable, value):
+        """adds a value, removing the least recently used ones if it goes over the limit"""
+        item_size = self.sizeof(value)
+
+        # don't let one huge value empty the whole cache
+        if item_size > self.max_size:
+            return
+
+        with self._lock:
+            if key in self._items:
+                self.size -= self._items.pop(key)[1]
+
+            if self.ttl is not None:
+                self._drop_expired()
+
+            expires = monotonic() + self.ttl if self.ttl is not None else None
+            self._items[key] = (value, item_size, expires)
+            self.size += item_size
+
+            while self.size > self.max_size:
+                _, (_, old_size, _) = self._items.popitem(last=False)
+                self.size -= old_size
+
+    def pop(self, key: Hashable, default=None):
+        """removes a value from the cache"""
+        with self._lock:
+            if key not in self._items:
+                return default
+
+            value, item_size, _ = self._items.pop(key)
+            self.size -= item_size
+
+            return value
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {
+            "items": len(self._items),
+            "size": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class DiskLRU:
+    """
+    least recently used cache of files in a folder, limited by their total size,
+    where files can also expire `ttl` seconds after they're written
+    """
+
+    def __init__(self, path: str, max_size: int, ttl: float = None):
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+        # name -> (size, when it expires)
+        self._files: OrderedDict[str, tuple[int, float | None]] = OrderedDict()
+        self._lock = Lock()
+
+        os.makedirs(path, exist_ok=True)
+        entries = []
+
+        for entry in os.scandir(path):
+            if entry.name.endswith(".tmp"):  # left over from a write that didn't finish
+                os.remove(entry.path)
+            elif entry.is_file():
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name, stat.st_size))
+
+        # files from before a restart are kept, the least recently used first
+        for modified, name, file_size in sorted(entries):
+            self._files[name] = (file_size, self._expiry(modified))
+            self.size += file_size
+
+        with self._lock:
+            removed = self._evict()
+
+        self._remove(removed)
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, key)
+
+    def _expiry(self, written: float) -> float | None:
+        return written + self.ttl if self.ttl is not None else None
+
+    def _evict(self) -> list[str]:
+        """forgets expired files, then the least recently used ones until it's under the limit (must hold the lock)"""
+        removed = []
+
+        if self.ttl is not None:
+            now = time()
+            removed = [k for k, (_, expires) in self._files.items() if expires <= now]
+
+            for name in removed:
+                self.size -= self._files.pop(name)[0]
+
+        while self.size > self.max_size:
+            name, (file_size, _) = self._files.popitem(last=False)
+            self.size -= file_size
+            removed.append(name)
+
+        return removed
+
+    def _remove(self, names: list[str]):
+        for name in names:
+            try:
+                os.remove(self._file(name))
+            except FileNotFoundError:
+                pass
+
+    def get(self, key: str) -> bytes | None:
+        """reads a file and marks it as recently used"""
+        with self._lock:
+            if key not in self._files:
+                self.misses += 1
+                return None
+
+            expires = self._files[key][1]
+            expired = expires is not None and expires <= time()
+
+            if expired:
+                self.size -= self._files.pop(key)[0]
+                self.misses += 1
+            else:
+                self._files.move_to_end(key)
+
+        if expired:
+            self._remove([key])
+            return None
+
+        try:
+            with open(self._file(key), "rb") as f:
+                data = f.read()
+
+            # keeps the order the same after a restart (files that expire keep when they were written instead)
+            if self.ttl is None:
+                os.utime(self._file(key))
+        except FileNotFoundError:
+            with self._lock:
+                if key in self._files:
+                    self.size -= self._files.pop(key)[0]
+
+                self.misses += 1
+
+            return None
+
+        self.hits += 1
+        return data
+
+    def set(self, key: str, data: bytes):
+        """writes a file (all at once so it's never read half written) and removes old ones"""
+        if len(data) > self.max_size:
+            return
+
+        temp = f"{self._file(key)}.{uuid4().hex}.tmp"
+
+        with open(temp, "wb") as f:
+            f.write(data)
+
+        os.replace(temp, self._file(key))
+
+        with self._lock:
+            if key in self._files:
+                self.size -= self._files.pop(key)[0]
+
+            self._files[key] = (len(data), self._expiry(time()))
+            self.size += len(data)
+            removed = self._evict()
+
+        self._remove(removed)
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {
+            "items": len(self._files),
+            "size": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class TieredCache:
+    """
+    items (a tuple of bytes followed by some small details about them) kept in memory,
+    and on disk for when they don't fit in memory anymore
+    """
+
+    def __init__(
+        self, memory_size: int, disk_path: str, disk_size: int, ttl: float = None
+    ):
+        self.memory = SizedLRU(memory_size, lambda item: len(item[0]), ttl)
+        self.disk_path = disk_path
+        self.disk_size = disk_size
+        self.ttl = ttl
+
+        self._disk: DiskLRU = None
+
+    @property
+    def disk(self) -> DiskLRU:
+        # made when first used, since worker processes import this too but never use it
+        if self._disk is None:
+            self._disk = DiskLRU(self.disk_path, self.disk_size, self.ttl)
+
+        return self._disk
+
+    async def get(self, key: str) -> tuple | None:
+        if (item := self.memory.get(key)) is not None:
+            return item
+
+        if (blob := await workers.Workers.io.run(self.disk.get, key)) is None:
+            return None
+
+        item = pickle.loads(blob)
+        self.memory.set(key, item)
+
+        return item
+
+    async def set(self, key: str, item: tuple):
+        self.memory.set(key, item)
+        await workers.Workers.io.run(self.disk.set, key, pickle.dumps(item))
+
+    @property
+    def stats(self) -> dict[str, dict[str, int]]:
+        return {"memory": self.memory.stats, "disk": self.disk.stats}
+
+
+# an edit result: the file, its name, and its mime type
+Result = tuple[BytesIO | None, str, str]
+
+
+class ResultCache(TieredCache):
+    """
+    keeps finished results, and lets identical requests that come in
+    at the same time share one run instead of each doing it
+    """
+
+    def __init__(
+        self, memory_size: int, disk_path: str, disk_size: int, max_item_size: int
+    ):
+        super().__init__(memory_size, disk_path, disk_size)
+        self.max_item_size = max_item_size
+        self._running: dict[str, asyncio.Task] = {}
+
+    async def _run(self, key: str, run: Callable[[], Awaitable[Result]]):
+        result, filename, mime = await run()
+
+        if result is None:  # failed edits aren't kept, so they get tried again next time
+            return None, filename, mime
+
+        # big results would push everything else out of memory (and be copied a few times to get there)
+        if result.seek(0, os.SEEK_END) > self.max_item_size:
+            result.seek(0)
+            return result.getvalue(), filename, mime
+
+        item = (result.getvalue(), filename, mime)
+        await self.set(key, item)
+
+        return item
+
+    async def run(self, key: str, run: Callable[[], Awaitable[Result]]) -> Result:
+        """gets the result for the key, calling run (once, even if asked for again meanwhile) if it isn't cached"""
+        if (item := await self.get(key)) is None:
+            if (task := self._running.get(key)) is None:
+                task = self._running[key] = asyncio.create_task(self._run(key, run))
+                task.add_done_callback(lambda _: self._running.pop(key, None))
+
+            # one request giving up shouldn't cancel the run for everyone else
+            item = await asyncio.shield(task)
+
+        data, filename, mime = item
+
+        # everyone gets their own file to read from
+        return (BytesIO(data) if data is not None else None), filename, mime
+
+    @property
+    def stats(self) -> dict[str, dict[str, int] | int]:
+        return {**super().stats, "running": len(self._running)}
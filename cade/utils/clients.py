@@ -1,21 +1,24 @@
 import configparser
 import logging
 
-import aiohttp
 import discord
 from discord.ext import commands, tasks
 from lavalink import Client, DefaultPlayer
+from pymongo.errors import PyMongoError
 from datetime import datetime, timedelta
 import os
 
 from cogs import COGS
 
-from .db import Internal
+from . import web
+from .db import Internal, LargeFilesDB
 from .events import BotEvents, TrackEvents
+from .jobs import JobScheduler
 from .keys import Keys
 from .useful import get_prefix
 from .vars import v
-from .ext import generate_cmd_list
+from .ext import generate_cmd_list, remove_expired_files, remove_orphaned_files
+from .workers import Workers
 
 
 class Cade(commands.Bot):
@@ -50,16 +53,31 @@ class Cade(commands.Bot):
         )
 
         if not ctx.command.hidden:
-            await Internal().inc_invoke_count(ctx.command.name)
+            Internal().inc_invoke_count(ctx.command.name)
+
+    async def _save_invoke_counts(self):
+        # an error would stop the loop for good, so it's logged instead (the counts are kept for next time)
+        try:
+            await Internal().save_invoke_counts()
+        except PyMongoError as e:
+            self.log.warning(f"couldn't save command counts: {e}")
 
     async def setup_hook(self):
-        self.session = aiohttp.ClientSession(loop=self.loop)
+        # shared by everything that makes web requests (see web.py)
+        self.web = web.shared
 
         for cog in COGS:
             await self.load_extension(cog)
 
+        # made after the cogs load, since loading them reloads utils
+        self.jobs = JobScheduler()
+        Workers.start()
+
         self.random_activity.start()
+        self.save_invoke_counts.start()
+        await LargeFilesDB().setup()
         self.clean_largefiles.start()
+        self.reconcile_largefiles.start()
         BotEvents(self).add()
 
         self.lavalink = CadeLavalink(self.user.id)
@@ -81,23 +99,20 @@ class Cade(commands.Bot):
         act_type, name = v.BOT__STATUS_MSG()
         await self.change_presence(activity=discord.Activity(type=act_type, name=name))
     
+    @tasks.loop(seconds=v.COUNTS__FLUSH_SECONDS)
+    async def save_invoke_counts(self):
+        await self._save_invoke_counts()
+
     @tasks.loop(seconds=120)
     async def clean_largefiles(self):
-        db = Internal().internal_db
-        largefiles = (await db.get()).largefiles
-        
-        for entry in largefiles:
-            guild_id: int = entry[0]
-            filename: str = entry[1]
-            creation_date: datetime = entry[2]
-
-            if (datetime.now() - creation_date).days > 0:
-                try:
-                    os.remove(f"./largefiles/{guild_id}/{filename}")
-                except:
-                    pass
-
-                await db.pull("largefiles", entry)
+        if removed := await remove_expired_files():
+            self.log.info(f"removed {removed} expired large file(s)")
+
+    @tasks.loop(hours=1)
+    async def reconcile_largefiles(self):
+        # catches files whose entries are gone (like if mongo expired them first)
+        if removed := await remove_orphaned_files():
+            self.log.info(f"removed {removed} orphaned large file(s)")
 
     @random_activity.before_loop
     async def _before(self):
@@ -107,8 +122,17 @@ class Cade(commands.Bot):
     async def _before(self):
         await self.wait_until_ready()
 
+    @reconcile_largefiles.before_loop
+    async def _before(self):
+        await self.wait_until_ready()
+
     async def close(self):
-        await self.session.close()
+        # so counts since the last save aren't lost
+        self.save_invoke_counts.stop()
+        await self._save_invoke_counts()
+
+        Workers.shutdown()
+        await self.web.close()
 
     def run(self):
         super().run(self.token, reconnect=True)
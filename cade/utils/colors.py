@@ -0,0 +1,45 @@
+import asyncio
+
+import aiohttp
+import discord
+
+from .cache import SizedLRU
+from .useful import MediaTooBig, get_average_color, read_from_url, run_async
+from .vars import v
+
+# average colors of artwork, keyed by its url
+_colors = SizedLRU(v.ARTWORK__CACHED_COLORS, lambda _: 1)
+_pending: dict[str, asyncio.Task] = {}
+
+
+async def _fetch_color(url: str) -> discord.Color:
+    try:
+        image = (await read_from_url(url))[1]
+        rgb = await run_async(get_average_color)(image) if image else None
+    except (aiohttp.ClientError, asyncio.TimeoutError, OSError, MediaTooBig):
+        rgb = None
+
+    if rgb is None:  # not kept, so it gets tried again next time
+        return discord.Color(v.BOT__PLAYING_TRACK_THEME)
+
+    color = discord.Color.from_rgb(*rgb)
+    _colors.set(url, color)
+
+    return color
+
+
+async def get_artwork_color(url: str) -> discord.Color:
+    """gets the average color of a track's artwork (only downloaded once, even if asked for again meanwhile)"""
+    if (color := _colors.get(url)) is not None:
+        return color
+
+    if (task := _pending.get(url)) is None:
+        task = _pending[url] = asyncio.create_task(_fetch_color(url))
+        task.add_done_callback(lambda _: _pending.pop(url, None))
+
+    return await asyncio.shield(task)
+
+
+async def prefetch_artwork_colors(urls: list[str]):
+    """gets the colors of several artworks at once, so they're ready when needed"""
+    await asyncio.gather(*map(get_artwork_color, dict.fromkeys(urls)))
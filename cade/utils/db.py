@@ -1,8 +1,12 @@
+import asyncio
 import configparser
-from datetime import datetime, timezone
+from collections import Counter
+from datetime import datetime, timedelta, timezone
 
 import discord
-from pymongo import AsyncMongoClient
+from pymongo import AsyncMongoClient, UpdateOne
+
+from .vars import v
 
 # load config file
 _config = configparser.ConfigParser()
@@ -14,6 +18,11 @@ _mongo_coll_name = str(_config.get("mongo", "collection"))
 
 _mongo_client = AsyncMongoClient(_mongo_uri)
 _db = _mongo_client[_mongo_db_name][_mongo_coll_name]
+_largefiles = _mongo_client[_mongo_db_name][v.LARGEFILES__COLLECTION]
+
+# command counts that haven't been saved yet (kept if utils gets reloaded, see BaseCog)
+_unsaved_counts: Counter[str] = globals().get("_unsaved_counts") or Counter()
+_saving_counts = globals().get("_saving_counts") or asyncio.Lock()
 
 
 class Document:
@@ -35,7 +44,6 @@ class InternalDoc:
         get = lambda key, default: self._doc.get(key, default)
 
         self.count: dict[str, int] = get("count", {})
-        self.largefiles: list = get("largefiles", [])
 
 
 class GuildDB:
@@ -94,10 +102,106 @@ class Internal:
 
     @property
     async def total_invoke_count(self) -> int:
-        return sum((await self._db_doc).get("count", {}).values())
+        saved = sum((await self._db_doc).get("count", {}).values())
+        return saved + sum(_unsaved_counts.values())
+
+    def inc_invoke_count(self, cmd: str) -> None:
+        """counts a command run (saved to the database later by save_invoke_counts)"""
+        _unsaved_counts[cmd] += 1
+
+    async def save_invoke_counts(self) -> None:
+        """adds every unsaved command count to the database at once"""
+        # one save at a time, so the same counts are never added twice
+        async with _saving_counts:
+            if not (counts := dict(_unsaved_counts)):
+                return
+
+            await self.internal_db._update(
+                {"$inc": {f"count.{cmd}": count for cmd, count in counts.items()}}
+            )
+
+            # only removed once they're saved, so they still show up in the totals meanwhile
+            _unsaved_counts.subtract(counts)
 
-    async def inc_invoke_count(self, cmd: str) -> None:
-        return await self.internal_db._update({"$inc": {f"count.{cmd}": 1}})
+            for cmd in [cmd for cmd, count in _unsaved_counts.items() if not count]:
+                del _unsaved_counts[cmd]
 
     async def get_invoke_count(self, cmd: str) -> int:
-        return (await self._db_doc).get("count", {}).get(cmd, 0)
+        saved = (await self._db_doc).get("count", {}).get(cmd, 0)
+        return saved + _unsaved_counts[cmd]
+
+
+class LargeFilesDB:
+    """files served by the image server (one document per file)"""
+
+    async def setup(self):
+        """makes the indexes and moves over files that were listed in the internal document"""
+        # mongo removes entries on its own a while after they expire, in case they're never cleaned up
+        await _largefiles.create_index(
+            "created",
+            expireAfterSeconds=v.LARGEFILES__TTL + v.LARGEFILES__TTL_SLACK,
+        )
+
+        # for finding the least recently served files (in a server)
+        await _largefiles.create_index([("guild_id", 1), ("created", 1)])
+
+        # each file is only listed once (which also keeps the move below from adding it twice)
+        await _largefiles.create_index([("guild_id", 1), ("filename", 1)], unique=True)
+
+        internal = Internal().internal_db
+        old_entries = (await internal.get())._doc.get("largefiles")
+
+        if old_entries:
+            # upserted so that running this again (like after a crash before the $unset) changes nothing
+            await _largefiles.bulk_write(
+                [
+                    UpdateOne(
+                        {"guild_id": entry[0], "filename": entry[1]},
+                        {
+                            "$setOnInsert": {
+                                # these were saved in local time, which mongo takes as utc
+                                "created": entry[2].replace(tzinfo=None).astimezone(timezone.utc),
+                                "stored": entry[3] if len(entry) > 3 else None,
+                            }
+                        },
+                        upsert=True,
+                    )
+                    for entry in old_entries
+                ],
+                ordered=False,
+            )
+
+        if old_entries is not None:
+            await internal._update({"$unset": {"largefiles": 1}})
+
+    async def add(self, guild_id: int, filename: str, stored: str):
+        await _largefiles.insert_one(
+            {
+                "guild_id": guild_id,
+                "filename": filename,
+                "created": datetime.now(timezone.utc),
+                "stored": stored,
+            }
+        )
+
+    async def pop_expired(self) -> list[dict]:
+        """removes (all at once) and returns the entries that are older than v.LARGEFILES__TTL"""
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=v.LARGEFILES__TTL)
+        expired = await _largefiles.find({"created": {"$lt": cutoff}}).to_list(None)
+
+        if expired:
+            await _largefiles.delete_many({"_id": {"$in": [e["_id"] for e in expired]}})
+
+        return expired
+
+    async def pop_oldest(self, guild_id: int = None) -> dict | None:
+        """removes and returns the least recently served entry (in a server if given)"""
+        return await _largefiles.find_one_and_delete(
+            {"guild_id": guild_id} if guild_id is not None else {},
+            sort=[("created", 1)],
+        )
+
+    async def names(self) -> set[tuple[int, str]]:
+        """(guild id, filename) of every file that's being served"""
+        cursor = _largefiles.find({}, {"_id": 0, "guild_id": 1, "filename": 1})
+        return {(entry["guild_id"], entry["filename"]) async for entry in cursor}
@@ -1,15 +1,45 @@
+from functools import partial, wraps
+from hashlib import sha256
 from io import BytesIO
-from tempfile import TemporaryDirectory
-from typing import Callable
+from math import prod
+from os import listdir
+from os.path import isfile
+from shlex import split
+from statistics import mode
+from subprocess import Popen
+from tempfile import TemporaryDirectory, TemporaryFile
+from typing import IO, Callable, Iterable, Iterator
 
-import cv2
 import numpy
-from PIL import Image, ImageFont, ImageSequence
+from PIL import GifImagePlugin, Image, ImageDraw, ImageSequence
 from pilmoji import Pilmoji
 
+from .cache import ResultCache, SizedLRU
+from .ext import hash_file
+from .layout import find_caption_end, get_font, wrap_text
+from .pipe import FramePipe, display_size
 from .useful import AttObj, get_media_kind, run_async, run_cmd
 from .vars import v
 
+# rendered caption headers, keyed by (text, width, emoji scale)
+_caption_headers = SizedLRU(
+    v.CACHE__CAPTION_HEADER_BYTES,
+    lambda header: header.width * header.height * len(header.getbands()),
+)
+
+# finished edits, keyed by a hash of the file and the edit (see _cached)
+_results = ResultCache(
+    v.CACHE__RESULT_MEMORY_BYTES,
+    v.CACHE__RESULT_PATH,
+    v.CACHE__RESULT_DISK_BYTES,
+    v.CACHE__RESULT_MAX_ITEM_BYTES,
+)
+
+
+# one edit in a chain, like ("caption", text), ("resize", width, height), or ("reverse",)
+Step = tuple
+
+
 def edit(res: AttObj):
     """gets the edit class for the given file"""
     kind = get_media_kind(res.filetype)
@@ -23,66 +53,303 @@ def edit(res: AttObj):
             return EditVideo(res)
 
 
+def _cached(func: Callable):
+    """reuses the result of an edit if the same file was already edited the same way"""
+
+    @wraps(func)
+    async def wrapper(self: "_Base", *args):
+        file_hash = await run_async(hash_file)(self.source.filebyte)
+        key = sha256(
+            repr(
+                (v.CACHE__RESULT_VERSION, file_hash, type(self).__name__, func.__name__, args)
+            ).encode()
+        ).hexdigest()
+
+        return await _results.run(key, partial(func, self, *args))
+
+    return wrapper
+
+
+def _bounds(mask: numpy.ndarray) -> tuple[int, int, int, int] | None:
+    """box (left, top, right, bottom) around the true values of a 2d mask"""
+    rows = numpy.flatnonzero(mask.any(axis=1))
+
+    if not rows.size:
+        return None
+
+    cols = numpy.flatnonzero(mask.any(axis=0))
+    return (int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1)
+
+
+def _union(a: tuple[int, int, int, int], b: tuple[int, int, int, int]):
+    return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+
+def _color_table_size(flags: int) -> int:
+    """size in bytes of the color table described by a gif's flags byte (0 if it has none)"""
+    return 3 << ((flags & 0b111) + 1) if flags & 0x80 else 0
+
+
+def _find_delays(gif: bytes | bytearray) -> list[int | None] | None:
+    """
+    finds where each frame's delay is stored in a gif (without decoding anything), giving
+    None for frames that don't have one, or None overall if the gif isn't laid out as expected
+    """
+    if gif[:6] not in (b"GIF87a", b"GIF89a"):
+        return None
+
+    def skip_sub_blocks(i: int) -> int:
+        while size := gif[i]:
+            i += size + 1
+
+        return i + 1
+
+    i = 13 + _color_table_size(gif[10])  # after the header and global color table
+    delay_at = None  # where the delay for the next frame is
+    offsets = []
+
+    try:
+        while (block := gif[i]) != 0x3B:  # trailer
+            if block == 0x21:  # extension
+                if gif[i + 1] == 0xF9 and gif[i + 2] == 4:  # graphic control extension
+                    delay_at = i + 4
+
+                i = skip_sub_blocks(i + 2)
+            elif block == 0x2C:  # image
+                offsets.append(delay_at)
+                delay_at = None
+
+                # skip the image descriptor, local color table, and lzw code size
+                i += 10 + _color_table_size(gif[i + 9])
+                i = skip_sub_blocks(i + 1)
+            else:
+                return None
+    except IndexError:
+        return None  # cut off
+
+    return offsets or None
+
+
+def _get_delay(gif: bytes | bytearray, offset: int | None) -> int:
+    return int.from_bytes(gif[offset : offset + 2], "little") if offset else 0
+
+
+def _scale_delay(delay: int, amount: float) -> int:
+    """speeds up a delay (in centiseconds), keeping it something viewers will play at that speed"""
+    if not delay or amount == 1:
+        return delay
+
+    return min(max(round(delay / amount), v.GIF__MIN_DELAY), 0xFFFF)
+
+
+def _write_playlist(path: str, frames: list[str], delays: list[int]):
+    """writes an ffconcat file that shows each frame for its delay (in centiseconds)"""
+    with open(path, "w") as playlist:
+        playlist.write("ffconcat version 1.0\n")
+
+        for frame, delay in zip(frames, delays):
+            # (the framerate only sets the timestamps' precision, and frames can't have no length)
+            playlist.write(f"file {frame}\noption framerate 100\nduration {max(delay, 1) / 100}\n")
+
+
+def _retime_gif(data: bytes, amount: float) -> bytearray | None:
+    """
+    speeds up a gif by changing each frame's delay directly in its bytes,
+    giving None if the gif can't be read that way or a frame has no delay to change
+    """
+    gif = bytearray(data)
+    offsets = _find_delays(gif)
+
+    if not offsets or None in offsets:
+        return None
+
+    for offset in offsets:
+        delay = _scale_delay(_get_delay(gif, offset), amount)
+        gif[offset : offset + 2] = delay.to_bytes(2, "little")
+
+    return gif
+
+
+class _PendingFrame:
+    """a frame that's waiting to be written (the next frame can still make it longer or clear it)"""
+
+    def __init__(self, pixels: numpy.ndarray, draw: numpy.ndarray, box: tuple, duration: int):
+        self.pixels = pixels  # the whole frame as rgba
+        self.draw = draw  # pixels that differ from what's already on screen
+        self.box = box  # the part of the frame that gets written
+        self.duration = duration
+        self.disposal = 1  # keep the frame on screen (2 clears its box afterwards)
+
+
+class _GifWriter:
+    """
+    writes a gif one frame at a time, only encoding the part of each frame that changed
+    (the previous frame is held back so it can be lengthened or cleared by the next one)
+    """
+
+    def __init__(self, fp: IO[bytes], duration: int, loop: int = 0):
+        self.fp = fp
+        self.duration = duration
+        self.loop = loop
+        self.frame_count = 0
+
+        self._pending: _PendingFrame = None
+
+    def _to_array(self, frame: Image.Image) -> numpy.ndarray:
+        pixels = numpy.array(frame.convert("RGBA"))
+
+        # every transparent pixel is the same, whatever its color
+        pixels[pixels[..., 3] == 0] = 0
+        return pixels
+
+    def _encode(self, frame: _PendingFrame) -> Image.Image:
+        """quantizes the frame's box, using a transparent color for pixels that don't need drawing"""
+        left, top, right, bottom = frame.box
+        pixels = frame.pixels[top:bottom, left:right]
+        hidden = ~frame.draw[top:bottom, left:right] | (pixels[..., 3] == 0)
+
+        rgb = numpy.ascontiguousarray(pixels[..., :3])
+
+        # frames that get cleared need a transparent color too, since some
+        # decoders clear to it instead of a transparent background
+        if not hidden.any() and frame.disposal == 1:
+            return Image.fromarray(rgb).convert("P", palette=Image.Palette.ADAPTIVE)
+
+        # give hidden pixels a color that's already used so they don't take up the palette
+        if hidden.any():
+            rgb[hidden] = rgb[~hidden][0] if not hidden.all() else 0
+
+        image = Image.fromarray(rgb).convert("P", palette=Image.Palette.ADAPTIVE, colors=255)
+
+        # the transparent color goes right after the used ones (small palettes stay small)
+        palette = image.getpalette()
+        transparency = len(palette) // 3
+
+        indices = numpy.array(image)
+        indices[hidden] = transparency
+
+        image = Image.fromarray(indices, "P")
+        image.putpalette(palette + [0, 0, 0])
+        image.info["transparency"] = transparency
+
+        return image
+
+    def _write(self, frame: _PendingFrame):
+        image = self._encode(frame)
+
+        if self.frame_count == 0:
+            # the header is based on the first frame (which always covers the whole gif)
+            header = GifImagePlugin.getheader(image, info={"loop": self.loop})[0]
+            self.fp.writelines(header)
+
+        params = {
+            "duration": frame.duration,
+            "disposal": frame.disposal,
+            "include_color_table": True,
+        }
+
+        if "transparency" in image.info:
+            params["transparency"] = image.info["transparency"]
+
+        self.fp.writelines(
+            GifImagePlugin.getdata(image, offset=frame.box[:2], **params)
+        )
+        self.frame_count += 1
+
+    def add(self, frame: Image.Image, duration: int = None):
+        """compares a frame to the last one, writing the last one once it's known how it ends"""
+        pixels = self._to_array(frame)
+        duration = self.duration if duration is None else duration
+        last = self._pending
+
+        if last is None:
+            # the first frame is drawn over a transparent background
+            height, width = pixels.shape[:2]
+            self._pending = _PendingFrame(
+                pixels, pixels[..., 3] > 0, (0, 0, width, height), duration
+            )
+            return
+
+        if numpy.array_equal(pixels, last.pixels):
+            last.duration += duration  # nothing changed, so the last frame just stays longer
+            return
+
+        # gif frames can't make pixels transparent again, so the last frame
+        # has to be cleared (and cover those pixels) for that to happen
+        cleared = (pixels[..., 3] == 0) & (last.pixels[..., 3] > 0)
+        on_screen = last.pixels
+
+        if cleared_box := _bounds(cleared):
+            last.box = _union(last.box, cleared_box)
+            last.disposal = 2
+
+            left, top, right, bottom = last.box
+            on_screen = on_screen.copy()
+            on_screen[top:bottom, left:right] = 0
+
+        draw = (pixels != on_screen).any(axis=2)
+        box = _bounds(draw)
+
+        if box is None:
+            box = (0, 0, 1, 1)  # the frame only clears things, but gifs can't have empty frames
+
+        self._write(last)
+        self._pending = _PendingFrame(pixels, draw, box, duration)
+
+    def close(self):
+        if self._pending:
+            self._write(self._pending)
+            self._pending = None
+
+        self.fp.write(b";")  # gif trailer
+
+
+def _fit_size(size: tuple[int, int], width: int | None, height: int | None) -> tuple[int, int]:
+    """fills in a missing width or height using the aspect ratio of the given size"""
+    if width is None:
+        width = round(size[0] * height / size[1])
+    elif height is None:
+        height = round(size[1] * width / size[0])
+
+    return (max(width, 1), max(height, 1))
+
+
+def _add_caption(header: Image.Image, mode: str, frame: Image.Image) -> Image.Image:
+    # create image that will contain both caption and original frame
+    captioned_frame = Image.new(mode, (frame.width, frame.height + header.height))
+
+    # add caption and then original frame under it
+    captioned_frame.paste(header, (0, 0))
+    captioned_frame.paste(frame, (0, header.height))
+
+    return captioned_frame
+
+
 class _Base:
-    def _wrap_text(self, font: ImageFont.FreeTypeFont, text: str, width: int) -> str:
-        """wraps text to fit in a caption"""
-        available_width = width - (width // 12)
-        pre_wrap_lines = text.splitlines()
-        wrapped_lines = []
-
-        i = 0
-        while i < len(pre_wrap_lines):
-            line = pre_wrap_lines[i]
-            words = line.split(" ")
-            current_line = ""
-            word_index = 0
-
-            while word_index < len(words):
-                test_line = (current_line + " " + words[word_index]).strip()
-                line_width = font.getlength(test_line)
-
-                # compare rendered width with available width
-                if line_width <= available_width:
-                    current_line = test_line
-                    word_index += 1
-                else:
-                    # splitting long words by character
-                    if current_line == "":
-                        long_word = words[word_index]
-                        split_index = 0
-                        partial = ""
-
-                        for j, char in enumerate(long_word):
-                            test_partial = partial + char
-
-                            if font.getlength(test_partial + "-") > available_width:
-                                break
-
-                            partial = test_partial
-                            split_index = j
-
-                        if split_index == 0:
-                            split_index = 1
-                            partial = long_word[:1]
-
-                        current_line = partial + "-"
-                        words[word_index] = long_word[split_index + 1 :]
-                    else:
-                        break
-
-            wrapped_lines.append(current_line.strip())
-
-            remaining = " ".join(words[word_index:])
-
-            if remaining:
-                pre_wrap_lines.insert(i + 1, remaining)
-
-            i += 1
-
-        return "\n".join(wrapped_lines)
-    
-    def create_caption_header(self, text: str, width: int):
+    source: AttObj
+
+    def __getstate__(self):
+        # only the original file is sent to worker processes, where it gets opened again
+        return {"source": self.source}
+
+    def __setstate__(self, state: dict):
+        state["source"].filebyte.seek(0)
+        self.__init__(state["source"])
+
+    def create_caption_header(self, text: str, width: int) -> Image.Image:
         """creates the caption image (white background with black text)"""
+        key = (text, width, v.CAPTION__EMOJI_SCALE)
+
+        # reuse the header if the same text was captioned at this width recently
+        # (it's shared, so it should only be pasted and never edited in place)
+        if (caption_img := _caption_headers.get(key)) is None:
+            caption_img = self._render_caption_header(text, width)
+            _caption_headers.set(key, caption_img)
+
+        return caption_img
+
+    def _render_caption_header(self, text: str, width: int) -> Image.Image:
+        """renders the caption text, measuring and drawing it with the same pilmoji instance"""
         spacing = width // v.CAPTION__SPACING_RATIO
         font_size = width // v.CAPTION__FONTSIZE_RATIO
         emoji_scale = v.CAPTION__EMOJI_SCALE
@@ -97,12 +364,10 @@ class _Base:
             text = text.replace(de, f"[#{i}#]")
             discord_emojis[i] = de
 
-        font = ImageFont.truetype(
-            v.PIL__FONT_PATH, font_size, layout_engine=ImageFont.Layout.RAQM
-        )
+        font = get_font(font_size)
 
         # wrap caption text
-        caption = self._wrap_text(font, text, width)
+        caption = wrap_text(font, text, width)
 
         # undo discord emoji placeholders
         for i, dep in enumerate(v.RE__DE_PLACEHOLDER.findall(caption)):
@@ -116,8 +381,14 @@ class _Base:
                 emoji_offset = -emoji_offset[1]
                 emoji_offset = (emoji_offset[0], int(width // -40))
 
-        # get the size of the rendered text
-        with Pilmoji(Image.new("RGB", (1, 1), v.PIL__WHITE)) as pilmoji:
+        # start with a canvas that is tall enough for any line (cropped after measuring)
+        ascent, descent = font.getmetrics()
+        line_height = max(ascent + descent, int(font_size * emoji_scale)) + spacing
+        max_height = (caption.count("\n") + 1) * line_height + font_size
+
+        caption_img = Image.new("RGB", (width, max_height), v.PIL__WHITE)
+
+        with Pilmoji(caption_img) as pilmoji:
             rendered_height = pilmoji.getsize(
                 text=caption,
                 font=font,
@@ -126,11 +397,12 @@ class _Base:
             )[1]
 
             text_height = rendered_height + font_size
+            x, y = width // 2, text_height // 2
 
-        caption_img = Image.new("RGB", (width, text_height), v.PIL__WHITE)
-        x, y = caption_img.width // 2, caption_img.height // 2
+            if text_height > max_height:  # shouldn't happen, but just in case
+                caption_img = Image.new("RGB", (width, text_height), v.PIL__WHITE)
+                pilmoji.image, pilmoji.draw = caption_img, ImageDraw.Draw(caption_img)
 
-        with Pilmoji(caption_img) as pilmoji:
             pilmoji.text(
                 (x, y),
                 caption,
@@ -143,39 +415,61 @@ class _Base:
                 emoji_position_offset=emoji_offset,
             )
 
-        return caption_img
-
-    def _get_content_bounds(self, frame: Image.Image | cv2.Mat):
-        """gets the largest congruent part of the frame without the caption"""
-        # convert PIL image to cv2 image
-        if isinstance(frame, Image.Image):
-            frame = cv2.cvtColor(numpy.array(frame), cv2.COLOR_RGB2BGR)
-
-        # invert the frame and convert it to grayscale
-        frame = cv2.cvtColor(cv2.bitwise_not(frame), cv2.COLOR_BGR2GRAY)
+        if text_height < caption_img.height:
+            caption_img = caption_img.crop((0, 0, width, text_height))
 
-        # get morph of grayscale image in order to better separate the caption
-        thresh = cv2.threshold(frame, 1, 255, cv2.THRESH_BINARY)[1]
-        morph_rect = cv2.getStructuringElement(cv2.MORPH_RECT, (1, 1))
-        morph = cv2.morphologyEx(thresh, cv2.MORPH_OPEN, morph_rect)
-
-        # finding the largest contour (actual content of the frame)
-        contours = cv2.findContours(morph, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        contours = contours[0] if len(contours) == 2 else contours[1]
-
-        largest_area = max(contours, key=cv2.contourArea)
-        _, y, _, _ = cv2.boundingRect(largest_area)
-
-        # part of frame to crop
-        bounds = 0, y, frame.shape[1], frame.shape[0]
+        return caption_img
 
-        return bounds
+    def _frame_edit(
+        self, step: Step, samples: list[Image.Image], mode: str
+    ) -> Callable[[Image.Image], Image.Image]:
+        """
+        makes a function that does a resize, caption, or uncaption step to a frame
+        (the sample frames are used to work out sizes and where the caption is)
+        """
+        match step:
+            case ("resize", width, height):
+                new_size = _fit_size(samples[0].size, width, height)
+                return lambda frame: frame.resize(new_size, reducing_gap=v.PIL__REDUCING_GAP)
+            case ("caption", text):
+                header = self.create_caption_header(text, samples[0].width)
+                return partial(_add_caption, header, mode)
+            case ("uncaption",):
+                bounds = self._get_content_bounds(samples)
+                return lambda frame: frame.crop(bounds)
+
+        raise ValueError(f"can't do {step[0]} to a single frame")
+
+    def _get_content_bounds(self, frames: list[Image.Image]) -> tuple[int, int, int, int]:
+        """gets the part of the frames without the caption, going with what most of them agree on"""
+        heights = [y for frame in frames if (y := find_caption_end(frame)) is not None]
+
+        width, height = frames[0].size
+        return (0, mode(heights) if heights else 0, width, height)
 
 
 class EditImage(_Base):
     def __init__(self, image: AttObj):
+        self.source = image
         self.filename = image.filename
-        self.file = Image.open(image.filebyte).convert("RGBA")
+        self.file = Image.open(image.filebyte)  # only decoded once an edit starts
+
+    def _load(self, target: tuple[int, int] = None):
+        """
+        decodes the image, only keeping an alpha channel if it has one
+        (jpegs that are about to be shrunk to the target size are decoded at a smaller scale)
+        """
+        if target:
+            gap = v.PIL__REDUCING_GAP
+            self.file.draft(None, (int(target[0] * gap), int(target[1] * gap)))
+
+        has_alpha = self.file.mode in ("RGBA", "LA", "PA") or "transparency" in self.file.info
+        mode = "RGBA" if has_alpha else "RGB"
+
+        if self.file.mode != mode:
+            self.file = self.file.convert(mode)
+        else:
+            self.file.load()
 
     def _save(self, img_format: str = "png", quality: int = 95):
         """general function for saving images as byte objects"""
@@ -189,237 +483,428 @@ class EditImage(_Base):
 
         return (result, f"{self.filename}.{img_format}", f"image/{img_format}")
 
-    @run_async
-    def jpeg(self) -> Callable[[], tuple[BytesIO, str, str]]:
-        """returns a low quality version of the image"""
-        file_rgba = self.file.convert("RGBA")
-
+    def _crunch(self):
+        """shrinks the image and puts it on a black background (the start of jpeg)"""
         # shrink the image to 80% of it's original size
-        orig_w, orig_h = file_rgba.size
+        orig_w, orig_h = self.file.size
         small_w = round(0.8 * orig_w)
         small_h = round(0.8 * orig_h)
         small = (small_w, small_h)
-        file_rgba = file_rgba.resize(small)
+        small_file = self.file.resize(small)
 
-        # create a black background behind the image (useful if it's a transparent png)
-        background = Image.new("RGBA", small, v.PIL__BLACK)
-        alpha_composite = Image.alpha_composite(background, file_rgba)
-        self.file = alpha_composite.convert("RGB")  # converting to RGB for jpeg output
+        if small_file.mode == "RGBA":
+            # create a black background behind the image (useful if it's a transparent png)
+            background = Image.new("RGBA", small, v.PIL__BLACK)
+            small_file = Image.alpha_composite(background, small_file)
 
-        result = self._save("jpeg", 4)
-        return result
+        self.file = small_file.convert("RGB")  # converting to RGB for jpeg output
 
-    @run_async
-    def resize(self, new_size: tuple[int, int]):
-        """resizes the image to a given size"""
-        self.file = self.file.resize(new_size)
+    def _run_steps(self, steps: list[Step]):
+        """does each step to the decoded image, then saves it once"""
+        target = None
 
-        result = self._save()
-        return result
+        if steps and steps[0][0] == "resize":
+            # the size is worked out before decoding (which could change it slightly)
+            target = _fit_size(self.file.size, *steps[0][1:])
+            steps = [("resize", *target), *steps[1:]]
 
-    @run_async
-    def caption(self, text: str):
-        """captions the image"""
-        width, height = self.file.size
-        caption = self.create_caption_header(text, width)
+        self._load(target)
 
-        # create a new image that contains both the caption and the original image
-        new_img = Image.new("RGBA", (width, height + caption.height))
+        for i, step in enumerate(steps):
+            if step[0] != "jpeg":
+                self.file = self._frame_edit(step, [self.file], self.file.mode)(self.file)
+                continue
 
-        new_img.paste(caption, (0, 0))
-        new_img.paste(self.file, (0, caption.height))
+            self._crunch()
 
-        self.file = new_img
+            if i == len(steps) - 1:
+                return self._save("jpeg", 4)
 
-        result = self._save()
-        return result
+            # the quality loss has to happen now for the next steps to build on it
+            crunched = BytesIO()
+            self.file.save(crunched, "jpeg", quality=4)
+            self.file = Image.open(crunched)
+            self._load()
 
-    @run_async
-    def uncaption(self):
-        """removes captions from the image"""
-        bounds = self._get_content_bounds(self.file)
+        return self._save()
 
-        self.file = self.file.crop(bounds)
+    @_cached
+    @run_async(pool="edit")
+    def chain(self, steps: list[Step]):
+        """does several edits to the image in a row"""
+        return self._run_steps(steps)
 
-        result = self._save()
-        return result
+    @_cached
+    @run_async(pool="edit")
+    def jpeg(self) -> Callable[[], tuple[BytesIO, str, str]]:
+        """returns a low quality version of the image"""
+        return self._run_steps([("jpeg",)])
+
+    @_cached
+    @run_async(pool="edit")
+    def resize(self, new_size: tuple[int, int]):
+        """resizes the image to a given size"""
+        return self._run_steps([("resize", *new_size)])
+
+    @_cached
+    @run_async(pool="edit")
+    def caption(self, text: str):
+        """captions the image"""
+        return self._run_steps([("caption", text)])
+
+    @_cached
+    @run_async(pool="edit")
+    def uncaption(self):
+        """removes captions from the image"""
+        return self._run_steps([("uncaption",)])
 
 
 class EditGif(_Base):
     def __init__(self, gif: AttObj):
+        self.source = gif
         self.filename = gif.filename.split(".")[0]
         self.file = Image.open(gif.filebyte)
         self.file.seek(0)
 
         self.frame_duration = self.file.info["duration"]
 
-        self.caption_header = None
-        self.uncaption_crop = None
-        self.speed_amount = None
-        self.resize_value = None
-
-    def _save(self, frames: list[Image.Image]) -> tuple[BytesIO, str, str]:
-        """converts the saved images into a gif byte object"""
+    def _save(self, frames: Iterable[tuple[Image.Image, int]]) -> tuple[BytesIO, str, str]:
+        """encodes the frames (with their durations) into a gif byte object as they come in"""
         result = BytesIO()
+        writer = _GifWriter(result, self.frame_duration)
 
-        # save the gif as bytes
-        frames[0].save(
-            result, 
-            format="GIF", 
-            save_all=True, 
-            append_images=frames[1:], 
-            optimize=False, 
-            duration=self.frame_duration, 
-            loop=0
-        )
+        for frame, duration in frames:
+            writer.add(frame, duration)
+
+        writer.close()
 
         self.file.close()
         result.seek(0)
 
         return (result, f"{self.filename}.gif", "image/gif")
-    
-    def _resize_process(self, frame: Image.Image) -> Image.Image:
-        resized_frame = frame.resize(self.resize_value)
-        return resized_frame
-    
-    def _caption_process(self, frame: Image.Image) -> Image.Image:
-        # create image that will contain both caption and original frame
-        captioned_frame = Image.new("RGB", (frame.width, frame.height + self.caption_header.height))
-
-        # add caption and then original frame under it
-        captioned_frame.paste(self.caption_header, (0, 0))
-        captioned_frame.paste(frame, (0, self.caption_header.height))
-
-        return captioned_frame
-    
-    def _uncaption_process(self, frame: Image.Image) -> Image.Image:
-        cropped_frame = frame.crop(self.uncaption_crop)
-        return cropped_frame
-    
-    def _no_process(self, frame: Image.Image) -> Image.Image:
-        return frame
-    
-    def _process_frames(self, function) -> list[Image.Image]:
-        return ImageSequence.all_frames(self.file, function)
-    
-    @run_async
+
+    def _frames(self) -> Iterator[tuple[Image.Image, int]]:
+        """decodes frames one at a time (instead of loading all of them)"""
+        for frame in ImageSequence.Iterator(self.file):
+            yield frame, frame.info.get("duration", self.frame_duration)
+
+    def _reversed_frames(self) -> Iterator[tuple[Image.Image, int]]:
+        """gives the frames in reverse order, keeping the decoded ones on disk"""
+        offsets = []
+        durations = []
+
+        with TemporaryFile() as spool:
+            # save each frame as a quick png to read back later
+            for frame, duration in self._frames():
+                offsets.append(spool.tell())
+                durations.append(duration)
+                frame.save(spool, "PNG", compress_level=1)
+
+            offsets.append(spool.tell())
+
+            for start, end, duration in reversed(list(zip(offsets, offsets[1:], durations))):
+                spool.seek(start)
+
+                with Image.open(BytesIO(spool.read(end - start))) as frame:
+                    frame.load()
+                    yield frame, duration
+
+    @staticmethod
+    def _sample_indexes(frame_count: int) -> list[int]:
+        """gets which frames to measure edits with"""
+        return sorted({round(p * (frame_count - 1)) for p in v.UNCAPTION__SAMPLE_POINTS})
+
+    def _sample_frames(self, spread: bool) -> list[Image.Image]:
+        """gets frames to measure edits with (from across the gif if spread, otherwise just the first)"""
+        frames = []
+
+        for index in self._sample_indexes(getattr(self.file, "n_frames", 1) if spread else 1):
+            self.file.seek(index)
+            frames.append(self.file.convert("RGB"))
+
+        return frames
+
+    def _run_ffmpeg(
+        self, data: bytes, edits: list[Step], delays: list[int], reverse: bool
+    ) -> bytearray | None:
+        """does the edits with ffmpeg (much faster for big gifs), giving None if it fails"""
+        video_filters = []
+        captions = 0
+
+        size = self.file.size
+
+        with TemporaryDirectory() as temp:
+            with open(f"{temp}/input.gif", "wb") as input:
+                input.write(data)
+
+            if ("uncaption",) in edits:
+                # seeking through a big gif with pillow decodes nearly all of it, so ffmpeg picks the frames out
+                indexes = self._sample_indexes(len(delays))
+
+                if Popen(split(v.FF__GIF_SAMPLES(temp, indexes))).wait() != 0:
+                    return None
+
+                samples = []
+
+                for name in sorted(f for f in listdir(temp) if f.startswith("sample")):
+                    with Image.open(f"{temp}/{name}") as frame:
+                        samples.append(frame.convert("RGB"))
+
+                if not samples:
+                    return None
+            else:
+                samples = self._sample_frames(False) if edits else []
+
+            for step in edits:
+                match step:
+                    case ("resize", width, height):
+                        size = _fit_size(size, width, height)
+                        video_filters.append("scale={}:{}:flags=bicubic".format(*size))
+                    case ("caption", text):
+                        caption = self.create_caption_header(text, size[0])
+                        captions += 1
+
+                        caption.save(f"{temp}/caption{captions}.png")
+                        # (overlay would convert the frames to yuv otherwise)
+                        video_filters.append(
+                            f"pad=width=iw:height=ih+{caption.height}:y={caption.height}:color=white"
+                            f"[c{captions}];[c{captions}][{captions}:v]overlay=format=auto"
+                        )
+                        size = (size[0], size[1] + caption.height)
+                    case ("uncaption",):
+                        left, top, right, bottom = bounds = self._get_content_bounds(samples)
+                        video_filters.append(f"crop={right - left}:{bottom - top}:{left}:{top}")
+                        size = (right - left, bottom - top)
+
+                        samples = [frame.crop(bounds) for frame in samples]
+                        continue
+
+                # keep the sample frames matching what ffmpeg will make
+                function = self._frame_edit(step, samples, "RGB")
+                samples = [function(frame) for frame in samples]
+
+            if reverse:
+                # decode every frame to disk, then read them back in the opposite order
+                if Popen(split(v.FF__GIF_FRAMES(temp))).wait() != 0:
+                    return None
+
+                frames = sorted((f for f in listdir(temp) if f.startswith("frame")), reverse=True)
+
+                if not frames:
+                    return None
+
+                if len(frames) != len(delays):
+                    # ffmpeg found a different number of frames, so the gif's length is shared between them
+                    delays = [round(sum(delays) / len(frames))] * len(frames)
+
+                _write_playlist(f"{temp}/reversed.ffconcat", frames, delays)
+                input = f"-f concat -safe 0 -i {temp}/reversed.ffconcat"
+            else:
+                input = f"-i {temp}/input.gif"
+
+            inputs = " ".join(f"-i {temp}/caption{i}.png" for i in range(1, captions + 1))
+            command = v.FF__GIF_EDIT(temp, input, inputs, ",".join(video_filters or ["null"]))
+
+            if Popen(split(command)).wait() != 0:
+                return None
+
+            with open(f"{temp}/output.gif", "rb") as output:
+                gif = bytearray(output.read())
+
+        # ffmpeg's timing is rounded (and the last frame's is lost), so the delays are copied over exactly
+        offsets = _find_delays(gif)
+
+        if offsets and None not in offsets and len(offsets) == len(delays):
+            for offset, delay in zip(offsets, delays):
+                gif[offset : offset + 2] = delay.to_bytes(2, "little")
+
+        return gif
+
+    def _run_steps(self, steps: list[Step]):
+        """does every step while decoding and encoding the gif only once"""
+        names = [step[0] for step in steps]
+        amount = prod(step[1] for step in steps if step[0] == "speed")
+
+        self.source.filebyte.seek(0)
+        data = self.source.filebyte.read()
+
+        # only the frame delays change, so the image data can stay as it is
+        if set(names) == {"speed"} and (retimed := _retime_gif(data, amount)):
+            self.file.close()
+            return (BytesIO(retimed), f"{self.filename}.gif", "image/gif")
+
+        # reversing doesn't depend on the other steps, so it's only done once (or not at all)
+        reverse = names.count("reverse") % 2 == 1
+        edits = [step for step in steps if step[0] not in ("speed", "reverse")]
+
+        # big gifs are edited by ffmpeg instead (when the frames can be counted without decoding)
+        if offsets := _find_delays(data):
+            width, height = self.file.size
+
+            if len(offsets) * width * height > v.GIF__FFMPEG_PIXELS:
+                delays = [_scale_delay(_get_delay(data, offset), amount) for offset in offsets]
+
+                if reverse:
+                    delays.reverse()
+
+                if result := self._run_ffmpeg(data, edits, delays, reverse):
+                    self.file.close()
+                    return (BytesIO(result), f"{self.filename}.gif", "image/gif")
+
+        # each edit is sized using what the sample frames look like after the ones before it
+        functions = []
+        samples = self._sample_frames(("uncaption",) in edits) if edits else []
+
+        for step in edits:
+            functions.append(self._frame_edit(step, samples, "RGB"))
+            samples = [functions[-1](frame) for frame in samples]
+
+        def edit_frame(frame: Image.Image, duration: int):
+            for function in functions:
+                frame = function(frame)
+
+            if duration and amount != 1:
+                duration = max(round(duration / amount), v.GIF__MIN_DELAY * 10)
+
+            return frame, duration
+
+        frames = self._reversed_frames() if reverse else self._frames()
+        return self._save(edit_frame(*frame) for frame in frames)
+
+    @_cached
+    @run_async(pool="edit")
+    def chain(self, steps: list[Step]):
+        """does several edits to the gif in a row"""
+        return self._run_steps(steps)
+
+    @_cached
+    @run_async(pool="edit")
     def resize(self, new_size: tuple[int, int]):
         """resizes the gif to a given size"""
-        self.resize_value = new_size
-
-        frames = self._process_frames(self._resize_process)
-        result = self._save(frames)
-        return result
+        return self._run_steps([("resize", *new_size)])
 
-    @run_async
+    @_cached
+    @run_async(pool="edit")
     def caption(self, text: str):
         """captions the gif"""
-        # create caption header
-        self.caption_header = self.create_caption_header(text, self.file.size[0])
+        return self._run_steps([("caption", text)])
 
-        frames = self._process_frames(self._caption_process)
-        result = self._save(frames)
-        return result
-
-    @run_async
+    @_cached
+    @run_async(pool="edit")
     def uncaption(self):
         """removes captions from the gif"""
-        self.file.seek(1)
-        self.uncaption_crop = self._get_content_bounds(self.file)
-
-        frames = self._process_frames(self._uncaption_process)
-        result = self._save(frames)
-        return result
+        return self._run_steps([("uncaption",)])
 
-    @run_async
+    @_cached
+    @run_async(pool="edit")
     def speed(self, amount: float):
         "speeds up the gif by a specified amount"
-        self.frame_duration = int(self.file.info["duration"] // amount)
+        return self._run_steps([("speed", amount)])
 
-        frames = self._process_frames(self._no_process)
-        result = self._save(frames)
-        return result
-
-    @run_async
+    @_cached
+    @run_async(pool="edit")
     def reverse(self):
         """reverses the gif"""
-        frames = self._process_frames(self._no_process)
-        frames.reverse()
-
-        result = self._save(frames)
-        return result
+        return self._run_steps([("reverse",)])
 
 
 class EditVideo(_Base):
     def __init__(self, video: AttObj):
+        self.source = video
         self.filename = video.filename
         self.video = video.filebyte
 
-    async def _get_size(self) -> tuple[int, int]:
-        """gets the dimensions of the video"""
+    async def _get_size(self) -> tuple[int, int] | None:
+        """gets the dimensions of the video (as it's shown, so turned if it has rotation metadata)"""
         result, returncode = await run_cmd(
             v.FF__GET_DIMENSIONS, self.video.getvalue(), decode=True
         )
 
-        if returncode != 0:
-            return
-
-        # turn bytes into characters and split the width and height
-        result = result.split("x")
-        result = tuple(map(int, result))
+        return display_size(result) if returncode == 0 else None
 
-        return result
+    async def _get_duration(self) -> float | None:
+        """gets the length of the video in seconds"""
+        result, returncode = await run_cmd(
+            v.FF__GET_DURATION, self.video.getvalue(), decode=True
+        )
 
-    def _get_frames(self, path):
-        """returns the fps and frames of a video for editing"""
-        input_video = f"{path}/input.mp4"
+        try:
+            return float(result) if returncode == 0 else None
+        except ValueError:
+            return  # ffprobe gives "N/A" for some streams
 
-        with open(input_video, "wb") as v_file:
-            v_file.write(self.video.getvalue())
+    def _write_input(self, path: str):
+        """writes the video to the directory (if it isn't there already)"""
+        if not isfile(f"{path}/input.mp4"):
+            with open(f"{path}/input.mp4", "wb") as input:
+                input.write(self.video.getvalue())
 
-        # get first frame of video and its fps
-        video = cv2.VideoCapture(input_video)
-        success, frame = video.read()
+    async def _sample_frames(self, path: str) -> list[Image.Image]:
+        """pulls a few frames from across the video without decoding all of it"""
+        duration = await self._get_duration() or 0
+        timestamps = sorted({round(duration * p, 3) for p in v.UNCAPTION__SAMPLE_POINTS})
 
+        self._write_input(path)
         frames = []
-        fps = video.get(cv2.CAP_PROP_FPS)
 
-        while success:
-            frames.append(frame)
-            success, frame = video.read()
+        for timestamp in timestamps:
+            frame_bytes, returncode = await run_cmd(v.FF__GET_FRAME(path, timestamp))
 
-        return fps, frames
+            if returncode == 0 and frame_bytes:
+                frames.append(Image.open(BytesIO(frame_bytes)).convert("RGB"))
 
-    async def _create_from_frames(self, path, fps):
-        """creates a video using all images in a directory"""
-        # make new frames into a video and add audio from original file
-        _, returncode = await run_cmd(v.FF__CREATE_MP4(path, fps))
+        return frames
 
-        if returncode != 0:
-            return
+    async def _get_fps(self) -> str | None:
+        """gets the frame rate of the video (as a fraction like 30000/1001)"""
+        result, returncode = await run_cmd(
+            v.FF__GET_FPS, self.video.getvalue(), decode=True
+        )
+
+        return result if returncode == 0 and result else None
 
-        with open(f"{path}/output.mp4", "rb") as output:
-            return BytesIO(output.read())
+    async def _process_frames(self, function: Callable[[numpy.ndarray], numpy.ndarray]) -> BytesIO | None:
+        """runs a function on every frame of the video, streaming them through ffmpeg"""
+        size = await self._get_size()
+        fps = await self._get_fps()
+
+        if not (size and fps):
+            return
 
-    async def _run_ffmpeg(self, command: str, *args):
         with TemporaryDirectory() as temp:
-            with open(f"{temp}/input.mp4", "wb") as input:
-                input.write(self.video.getvalue())
+            self._write_input(temp)
 
-            # resize the video using the given size
-            _, returncode = await run_cmd(command(temp, *args))
+            pipe = FramePipe(temp, size, fps)
+            returncode = await run_async(pipe.run)(function)
 
             if returncode != 0:
                 return
 
             with open(f"{temp}/output.mp4", "rb") as output:
-                result_bytes = BytesIO(output.read())
+                return BytesIO(output.read())
+
+    async def _run_ffmpeg(self, command: Callable[..., str], *args, temp: str = None):
+        """runs an ffmpeg command on the video (in a given directory or a new one)"""
+        if temp is None:
+            with TemporaryDirectory() as temp:
+                return await self._run_ffmpeg(command, *args, temp=temp)
+
+        self._write_input(temp)
+
+        _, returncode = await run_cmd(command(temp, *args))
+
+        if returncode != 0:
+            return
+
+        with open(f"{temp}/output.mp4", "rb") as output:
+            result_bytes = BytesIO(output.read())
 
         return result_bytes
 
     def _save(self) -> tuple[BytesIO | None, str, str]:
         return (self.video, f"{self.filename}.mp4", "video/mp4")
 
+    @_cached
     async def resize(self, new_size: tuple[int, int]):
         """resizes the video to the specified size"""
         self.video = await self._run_ffmpeg(v.FF__RESIZE, *new_size)
@@ -427,6 +912,7 @@ class EditVideo(_Base):
         result = self._save()
         return result
 
+    @_cached
     async def speed(self, amount: float):
         """speeds up the video by the given amount"""
         if amount < 0.5:
@@ -437,39 +923,99 @@ class EditVideo(_Base):
         result = self._save()
         return result
 
+    @_cached
     async def caption(self, text: str):
         """captions the video"""
         width, _ = await self._get_size()
 
-        # get caption image and convert it into a cv2 image
+        # the caption is only made once and ffmpeg stacks it onto every frame
         caption = self.create_caption_header(text, width)
-        c_img = cv2.cvtColor(numpy.array(caption), cv2.COLOR_RGB2BGR)
 
         with TemporaryDirectory() as temp:
-            fps, frames = self._get_frames(temp)
+            caption.save(f"{temp}/caption.png")
+            self.video = await self._run_ffmpeg(v.FF__CAPTION, caption.height, temp=temp)
 
-            # save each frame and add the caption on top
-            for i, frame in enumerate(frames):
-                new_frame = cv2.vconcat([c_img, frame])
-                cv2.imwrite(f"{temp}/{i}.png", new_frame)
+        result = self._save()
+        return result
 
-            self.video = await self._create_from_frames(temp, fps)
+    @_cached
+    async def chain(self, steps: list[Step]):
+        """does several edits to the video with one ffmpeg command (so it's only encoded once)"""
+        size = await self._get_size()
+
+        if not size:
+            self.video = None
+            return self._save()
+
+        video_filters, audio_filters = [], []
+        captions = 0
+
+        with TemporaryDirectory() as temp:
+            # frames that get the same edits as the video, for finding captions to remove
+            if any(step[0] == "uncaption" for step in steps):
+                samples = await self._sample_frames(temp)
+            else:
+                samples = []
+
+            for step in steps:
+                match step:
+                    case ("resize", width, height):
+                        size = _fit_size(size, width, height)
+                        video_filters.append("scale={}:{}".format(*size))
+                    case ("caption", text):
+                        caption = self.create_caption_header(text, size[0])
+                        captions += 1
+
+                        caption.save(f"{temp}/caption{captions}.png")
+                        video_filters.append(
+                            f"pad=width=iw:height=ih+{caption.height}:y={caption.height}:color=white"
+                            f"[c{captions}];[c{captions}][{captions}:v]overlay"
+                        )
+                        size = (size[0], size[1] + caption.height)
+                    case ("uncaption",):
+                        if not samples:
+                            self.video = None
+                            return self._save()
+
+                        y = self._get_content_bounds(samples)[1]
+                        video_filters.append(f"crop=iw:ih-{y}:0:{y}")
+                        size = (size[0], size[1] - y)
+                    case ("speed", amount):
+                        amount = max(amount, 0.5)  # smallest multiplier for videos
+
+                        video_filters.append(f"setpts=PTS/{amount}")
+                        audio_filters.append(f"atempo={amount}")
+
+                if samples and step[0] in ("resize", "caption"):
+                    function = self._frame_edit(step, samples, "RGB")
+                    samples = [function(frame) for frame in samples]
+                elif samples and step[0] == "uncaption":
+                    samples = [frame.crop((0, y, *frame.size)) for frame in samples]
+
+            inputs = " ".join(f"-i {temp}/caption{i}.png" for i in range(1, captions + 1))
+
+            self.video = await self._run_ffmpeg(
+                v.FF__CHAIN,
+                inputs,
+                ",".join(video_filters or ["null"]),
+                ",".join(audio_filters),
+                temp=temp,
+            )
 
         result = self._save()
         return result
 
+    @_cached
     async def uncaption(self):
         """removes captions from the video"""
         with TemporaryDirectory() as temp:
-            fps, frames = self._get_frames(temp)
-            x, y, w, h = self._get_content_bounds(frames[0])
-
-            for i, frame in enumerate(frames):
-                # crop each frame down to its content
-                cropped_frame = frame[y : y + h, x : x + w]
-                cv2.imwrite(f"{temp}/{i}.png", cropped_frame)
+            frames = await self._sample_frames(temp)
 
-            self.video = await self._create_from_frames(temp, fps)
+            if frames:
+                y = self._get_content_bounds(frames)[1]
+                self.video = await self._run_ffmpeg(v.FF__CROP, y, temp=temp)
+            else:
+                self.video = None
 
         result = self._save()
         return result
@@ -11,6 +11,7 @@ from lavalink import (
 
 from .base import BaseEmbed, CadeElegy
 from .db import GuildDB
+from .jobs import RateLimited
 from .useful import format_time, get_artwork_url
 from .vars import v
 from .views import NowPlayingView
@@ -103,6 +104,8 @@ class BotEvents:
             (commands.CheckFailure, commands.DisabledCommand, commands.CommandNotFound),
         ):
             return  # ignore errors that aren't important
+        elif isinstance(error, RateLimited):
+            return  # the user was already told to slow down
 
         raise error
 
@@ -1,35 +1,303 @@
-from io import BytesIO
-from typing import Mapping
+import asyncio
+from collections import defaultdict
+from io import BufferedReader, BytesIO
+from typing import IO, Mapping
 from pathlib import Path
-from datetime import datetime
+from hashlib import sha256
+from os.path import splitext
+from threading import Lock
+from time import time
+from uuid import uuid4
+import os
 import random
+import shutil
 import string
 
 from discord.ext import commands
 
+from . import workers
 from .keys import Keys
-from .db import Internal
+from .db import LargeFilesDB
+from .vars import v
 
 
-async def serve_very_big_file(guild_id: int, media: tuple[BytesIO, str, str]):
-    """uploads media to the image server"""
-    file_dir = f"./largefiles/{guild_id}"
+def write_file(path: str, file: IO[bytes]):
+    """writes the file to the path without making another copy of it in memory"""
+    file.seek(0)
+
+    with open(path, "wb") as f:
+        if isinstance(file, BytesIO):
+            with file.getbuffer() as data:
+                f.write(data)
+        elif isinstance(file, BufferedReader):
+            # both are real files, so the kernel can copy between them directly
+            size = os.fstat(file.fileno()).st_size
+            offset = 0
+
+            while offset < size:
+                offset += os.sendfile(f.fileno(), file.fileno(), offset, size - offset)
+        else:
+            shutil.copyfileobj(file, f, v.MEDIA__CHUNK_BYTES)
+
+
+def hash_file(file: IO[bytes]) -> str:
+    """sha256 of the whole file (read in chunks)"""
+    file_hash = sha256()
+    file.seek(0)
+
+    while chunk := file.read(v.MEDIA__CHUNK_BYTES):
+        file_hash.update(chunk)
+
+    file.seek(0)
+    return file_hash.hexdigest()
+
+
+# stops a stored file from being removed while it's being linked to (and the other way around)
+_store_lock = Lock()
+
+# only one file is made room for at a time, so two uploads can't both take the same space
+_serve_lock = asyncio.Lock()
+
+
+def _quota(mb: str | None, default: int = None) -> int | None:
+    return int(mb) * 2**20 if mb else default
+
+
+def _guild_folders() -> list[os.DirEntry]:
+    with os.scandir(v.LARGEFILES__PATH) as folders:
+        return [f for f in folders if f.is_dir() and f.name.isdigit()]
+
+
+class _DiskUsage:
+    """
+    bytes used by the image server, counted from the files once and then kept up to date
+    as files are added and removed (must hold the lock to use)
+    """
+
+    def __init__(self):
+        self.total = 0  # every file on disk (counted once no matter how many links it has)
+        self.guilds: dict[int, int] = defaultdict(int)  # what each server's links add up to
+        self.loaded = False
+
+    def load(self):
+        if self.loaded:
+            return
+
+        with os.scandir(v.LARGEFILES__STORE) as stored_files:
+            self.total = sum(
+                f.stat().st_size
+                for f in stored_files
+                if f.is_file() and not f.name.endswith(".tmp")
+            )
+
+        self.guilds = defaultdict(int)
+
+        for folder in _guild_folders():
+            with os.scandir(folder.path) as files:
+                for file in files:
+                    if not file.is_file():
+                        continue
+
+                    stat = file.stat()
+                    self.guilds[int(folder.name)] += stat.st_size
+
+                    # served before files were stored by hash, so it isn't in the store
+                    if stat.st_nlink == 1:
+                        self.total += stat.st_size
+
+        self.loaded = True
+
+
+_usage = _DiskUsage()
+
+
+def _link_large_file(file: IO[bytes], size: int, path: str, guild_id: int, stored: str):
+    """
+    stores the file once (named by its hash) and hard links the path to it,
+    so the same file served in several places only takes up space once
+    """
+    stored = f"{v.LARGEFILES__STORE}/{stored}"
+
+    with _store_lock:
+        _usage.load()
+
+        if not os.path.exists(stored):
+            # written to a temporary name first so it's never served half written
+            temp = f"{stored}.{uuid4().hex}.tmp"
+            write_file(temp, file)
+            os.replace(temp, stored)
+            _usage.total += size
+
+        os.link(stored, path)
+        _usage.guilds[guild_id] += size
+
+
+def _unlink(path: str, guild_id: int):
+    """removes a served file (must hold the lock)"""
+    try:
+        stat = os.stat(path)
+        os.remove(path)
+    except FileNotFoundError:
+        return
+
+    _usage.guilds[guild_id] -= stat.st_size
+
+    if stat.st_nlink == 1:  # it was the last link to the file
+        _usage.total -= stat.st_size
+
+
+def _remove_unused(stored: str):
+    """removes a stored file if its own link is the only one left (must hold the lock)"""
+    try:
+        stat = os.stat(stored)
+
+        if stat.st_nlink == 1:
+            os.remove(stored)
+            _usage.total -= stat.st_size
+    except FileNotFoundError:
+        pass
+
+
+def _unlink_large_files(entries: list[tuple[int, str, str | None]]):
+    """removes (guild id, filename, stored name) entries, and the stored files nothing uses anymore"""
+    with _store_lock:
+        _usage.load()
+
+        for guild_id, filename, stored in entries:
+            _unlink(f"{v.LARGEFILES__PATH}/{guild_id}/{filename}", guild_id)
+
+            if stored:  # files served before they were stored by hash don't have one
+                _remove_unused(f"{v.LARGEFILES__STORE}/{stored}")
+
+
+def _over_quota(guild_id: int, size: int, stored: str) -> str | None:
+    """which quota ("total" or "guild") a new file would go over, if any"""
+    with _store_lock:
+        _usage.load()
+
+        # a file that's already stored only takes up more space in the server's quota
+        new_bytes = 0 if os.path.exists(f"{v.LARGEFILES__STORE}/{stored}") else size
+
+        if _usage.total + new_bytes > _quota(Keys.image.quota, v.LARGEFILES__QUOTA):
+            return "total"
+
+        guild_quota = _quota(Keys.image.guild_quota)
+
+        if guild_quota and _usage.guilds[guild_id] + size > guild_quota:
+            return "guild"
+
+
+def _reconcile_large_files(known: set[tuple[int, str]]) -> int:
+    """removes served files the database doesn't know about (like ones whose entry expired), returning how many"""
+    # a file served just now might not be in the database yet
+    cutoff = time() - v.LARGEFILES__GRACE
+    removed = 0
+
+    with _store_lock:
+        _usage.load()
+
+        for folder in _guild_folders():
+            guild_id = int(folder.name)
+
+            with os.scandir(folder.path) as files:
+                for file in files:
+                    # the ctime changes when a link is made, so it's when the file was served
+                    if (
+                        (guild_id, file.name) not in known
+                        and file.is_file()
+                        and file.stat().st_ctime < cutoff
+                    ):
+                        _unlink(file.path, guild_id)
+                        removed += 1
+
+        with os.scandir(v.LARGEFILES__STORE) as stored_files:
+            for stored in stored_files:
+                if stored.stat().st_ctime >= cutoff:
+                    continue
+
+                if stored.name.endswith(".tmp"):  # left over from a write that didn't finish
+                    os.remove(stored.path)
+                else:
+                    _remove_unused(stored.path)
+
+    return removed
+
+
+async def _make_room(guild_id: int, size: int, stored: str) -> bool:
+    """removes the least recently served files until the new one fits, returning if it does"""
+    total_quota = _quota(Keys.image.quota, v.LARGEFILES__QUOTA)
+    guild_quota = _quota(Keys.image.guild_quota)
+
+    if size > total_quota or (guild_quota and size > guild_quota):
+        return False
+
+    while over := await workers.Workers.io.run(_over_quota, guild_id, size, stored):
+        entry = await LargeFilesDB().pop_oldest(guild_id if over == "guild" else None)
+
+        if entry is None:
+            return False
+
+        await workers.Workers.io.run(
+            _unlink_large_files,
+            [(entry["guild_id"], entry["filename"], entry.get("stored"))],
+        )
+
+    return True
+
+
+async def serve_very_big_file(
+    guild_id: int, media: tuple[IO[bytes], str, str]
+) -> str | None:
+    """uploads media to the image server (None if there's no room for it)"""
+    file_dir = f"{v.LARGEFILES__PATH}/{guild_id}"
 
     Path(file_dir).mkdir(parents=True, exist_ok=True)
+    Path(v.LARGEFILES__STORE).mkdir(parents=True, exist_ok=True)
 
     rand_code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=5))
     filename = rand_code + "_" + media[1]
 
-    db = Internal().internal_db
-    await db.push("largefiles", [guild_id, filename, datetime.now()])
+    try:
+        file_hash = await workers.Workers.io.run(hash_file, media[0])
+        stored = file_hash + splitext(filename)[1]
+        size = media[0].seek(0, os.SEEK_END)
+
+        async with _serve_lock:
+            if not await _make_room(guild_id, size, stored):
+                return None
 
-    with open(f"{file_dir}/{filename}", "wb") as f:
-        f.write(media[0].read())
-        f.seek(0)
+            await workers.Workers.io.run(
+                _link_large_file, media[0], size, f"{file_dir}/{filename}", guild_id, stored
+            )
+    finally:
+        media[0].close()
+
+    await LargeFilesDB().add(guild_id, filename, stored)
 
     return f"{Keys.image.domain}/{guild_id}/{filename}"
 
 
+async def remove_expired_files() -> int:
+    """removes media from the image server once it expires, returning how many"""
+    expired = await LargeFilesDB().pop_expired()
+
+    if expired:
+        await workers.Workers.io.run(
+            _unlink_large_files,
+            [(e["guild_id"], e["filename"], e.get("stored")) for e in expired],
+        )
+
+    return len(expired)
+
+
+async def remove_orphaned_files() -> int:
+    """removes media from the image server that isn't in the database, returning how many"""
+    Path(v.LARGEFILES__STORE).mkdir(parents=True, exist_ok=True)
+
+    known = await LargeFilesDB().names()
+    return await workers.Workers.io.run(_reconcile_large_files, known)
+
+
 def generate_cmd_list(bot_cogs: Mapping[str, commands.Cog]):
     """generates the command list (commands.md)"""
     cogs = list(reversed(bot_cogs.values()))
@@ -0,0 +1,151 @@
+from io import BytesIO
+from math import log2
+from os.path import getsize, splitext
+from shlex import split
+from subprocess import run
+from tempfile import TemporaryDirectory
+from typing import IO
+
+from . import workers
+from .ext import write_file
+from .vars import v
+
+# (every nth frame, scale, colors)
+_GifSettings = tuple[int, float, int]
+
+
+def _run(cmd: str) -> tuple[str, int]:
+    p = run(split(cmd), capture_output=True)
+    return p.stdout.decode("utf-8").strip(), p.returncode
+
+
+def _guess_gif_size(size: int, settings: _GifSettings) -> float:
+    """rough guess of how big a gif gets with the given settings (only relative to the others)"""
+    step, scale, colors = settings
+    return size / step * scale**2 * log2(colors) / 8
+
+
+def _pick_gif_settings(
+    size: int, target: int, correction: float, above: float, below: float
+) -> _GifSettings | None:
+    """
+    the settings that change the gif the least while (probably) fitting, where correction
+    is how far off the guesses were so far, and the guess has to be between above and below
+    (so settings that were already tried aren't tried again)
+    """
+    best, best_score = None, 0
+
+    for step in v.FIT__GIF_STEPS:
+        for scale in v.FIT__GIF_SCALES:
+            for colors in v.FIT__GIF_COLORS:
+                guess = _guess_gif_size(size, (step, scale, colors))
+
+                if not above < guess < below or guess * correction > target:
+                    continue
+
+                # dropping frames is noticed more than the rest, so it's only done if needed
+                if (score := guess / step**0.5) > best_score:
+                    best, best_score = (step, scale, colors), score
+
+    return best
+
+
+def _fit_gif(temp: str, input: str, size: int, target: int) -> bytes | None:
+    correction = 1.0
+    above, below = 0, float("inf")
+    result = None
+
+    for _ in range(v.FIT__GIF_ATTEMPTS):
+        settings = _pick_gif_settings(size, target, correction, above, below)
+
+        if not settings:
+            break
+
+        _, returncode = _run(v.FF__FIT_GIF(temp, input, *settings))
+
+        if returncode != 0:
+            break
+
+        guess = _guess_gif_size(size, settings)
+        new_size = getsize(f"{temp}/output.gif")
+        correction = new_size / guess  # the next try uses what was learned from this one
+
+        if new_size > target:
+            below = guess
+            continue
+
+        # it fits, but if it's a lot smaller than it needs to be, try changing it less
+        above = guess
+
+        with open(f"{temp}/output.gif", "rb") as f:
+            result = f.read()
+
+        if new_size >= target * v.FIT__GOOD_ENOUGH:
+            break
+
+    return result
+
+
+def _fit_video(temp: str, input: str, target: int) -> bytes | None:
+    duration, returncode = _run(v.FF__PROBE_DURATION(input))
+
+    try:
+        duration = float(duration)
+    except ValueError:
+        return
+
+    if returncode != 0 or duration <= 0:
+        return
+
+    kbps = target * 8 / 1000 / duration - v.FIT__AUDIO_KBPS
+
+    for passes in (False, True):
+        if kbps < v.FIT__MIN_VIDEO_KBPS:
+            return
+
+        # lower bitrates look better at lower resolutions
+        height = next(h for min_kbps, h in v.FIT__VIDEO_HEIGHTS if kbps >= min_kbps)
+        args = (temp, input, height, int(kbps), v.FIT__AUDIO_KBPS)
+
+        # one pass is usually close enough, and two passes hit the bitrate much more exactly
+        commands = v.FF__FIT_VIDEO_PASSES(*args) if passes else (v.FF__FIT_VIDEO(*args),)
+
+        for command in commands:
+            if _run(command)[1] != 0:
+                return
+
+        new_size = getsize(f"{temp}/output.mp4")
+
+        if new_size <= target:
+            with open(f"{temp}/output.mp4", "rb") as f:
+                return f.read()
+
+        kbps *= target / new_size * v.FIT__MARGIN
+
+
+def _fit(file: IO[bytes], filename: str, mime: str, size: int, limit: int):
+    target = int(limit * v.FIT__MARGIN)
+
+    with TemporaryDirectory() as temp:
+        # named after the type instead of the user's filename, since it goes into a command
+        input = f"{temp}/input.{'gif' if mime == 'image/gif' else 'mp4'}"
+        write_file(input, file)
+        file.seek(0)
+
+        if mime == "image/gif":
+            if result := _fit_gif(temp, input, size, target):
+                return BytesIO(result), filename, mime
+        elif (result := _fit_video(temp, input, target)) is not None:
+            return BytesIO(result), f"{splitext(filename)[0]}.mp4", "video/mp4"
+
+
+async def fit_under(
+    media: tuple[IO[bytes], str, str], size: int, limit: int
+) -> tuple[BytesIO, str, str] | None:
+    """tries to shrink a gif or video until it's under the limit (None if it can't)"""
+    file, filename, mime = media
+
+    if not mime or (mime != "image/gif" and not mime.startswith("video/")):
+        return
+
+    return await workers.Workers.io.run(_fit, file, filename, mime, size, limit)
@@ -0,0 +1,240 @@
+import asyncio
+import math
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from time import monotonic
+
+import discord
+from discord.ext import commands
+
+from .vars import v
+
+
+class RateLimited(commands.CommandError):
+    """raised when a user runs media commands too quickly (the error message is already sent)"""
+
+
+class _TokenBucket:
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate  # tokens gained per second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = monotonic()
+
+    def _refill(self):
+        now = monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    @property
+    def full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+    def take(self) -> float:
+        """takes a token, returning 0 if it worked or the seconds until one is available"""
+        self._refill()
+
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+
+        return (1 - self.tokens) / self.rate
+
+
+@dataclass(eq=False)
+class _Job:
+    guild_id: int
+    message: discord.Message
+    status: str | None
+    started: asyncio.Future = field(default_factory=lambda: asyncio.get_running_loop().create_future())
+    shown_position: int | None = None
+
+
+class JobScheduler:
+    """
+    limits how many media jobs run at once (overall and per server), rate limits users,
+    and takes turns between servers so one server can't fill up the whole queue
+    """
+
+    def __init__(
+        self,
+        max_running: int = v.JOBS__MAX_RUNNING,
+        max_per_guild: int = v.JOBS__MAX_PER_GUILD,
+        user_rate: float = v.JOBS__USER_RATE,
+        user_burst: int = v.JOBS__USER_BURST,
+    ):
+        self.max_running = max_running
+        self.max_per_guild = max_per_guild
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+
+        self._waiting: dict[int, deque[_Job]] = {}
+        self._rotation: deque[int] = deque()  # order that servers get their turn in
+        self._running: dict[int, int] = defaultdict(int)
+        self._total_running = 0
+
+        self._buckets: dict[int, _TokenBucket] = {}
+        self._avg_duration = v.JOBS__FIRST_ESTIMATE
+        self._refresher: asyncio.Task = None
+
+    @property
+    def stats(self) -> dict[str, int | float]:
+        return {
+            "running": self._total_running,
+            "waiting": sum(len(jobs) for jobs in self._waiting.values()),
+            "avg_duration": round(self._avg_duration, 2),
+        }
+
+    async def _check_rate(self, user_id: int, message: discord.Message):
+        if len(self._buckets) > v.JOBS__MAX_BUCKETS:
+            # full buckets are the same as new ones, so they don't need to be kept
+            for key in [k for k, bucket in self._buckets.items() if bucket.full]:
+                del self._buckets[key]
+
+        bucket = self._buckets.setdefault(
+            user_id, _TokenBucket(self.user_rate, self.user_burst)
+        )
+
+        if wait := bucket.take():
+            await message.edit(content=v.ERR__RATE_LIMITED(math.ceil(wait)), embed=None)
+            raise RateLimited()
+
+    def _position(self, job: _Job) -> int:
+        """where the job is in line, going by the order servers take turns in"""
+        index = self._waiting[job.guild_id].index(job)
+        ahead = 0
+        passed = False
+
+        for guild_id in self._rotation:
+            if guild_id == job.guild_id:
+                ahead += index
+                passed = True
+            else:
+                # servers before this one in the rotation get one extra turn first
+                ahead += min(len(self._waiting[guild_id]), index + (not passed))
+
+        return ahead + 1
+
+    def _eta(self, position: int) -> int:
+        return math.ceil(math.ceil(position / self.max_running) * self._avg_duration)
+
+    def _dispatch(self):
+        """starts waiting jobs while there is room, taking turns between servers"""
+        while self._total_running < self.max_running:
+            for i, guild_id in enumerate(self._rotation):
+                if self._running[guild_id] < self.max_per_guild:
+                    break
+            else:
+                return  # every waiting server is at its limit
+
+            jobs = self._waiting[guild_id]
+            job = jobs.popleft()
+
+            # the server goes to the back of the line
+            del self._rotation[i]
+
+            if jobs:
+                self._rotation.append(guild_id)
+            else:
+                del self._waiting[guild_id]
+
+            self._running[guild_id] += 1
+            self._total_running += 1
+            job.started.set_result(None)
+
+    def _finish(self, job: _Job, duration: float | None):
+        self._running[job.guild_id] -= 1
+        self._total_running -= 1
+
+        if not self._running[job.guild_id]:
+            del self._running[job.guild_id]
+
+        if duration is not None:
+            self._avg_duration = self._avg_duration * 0.8 + duration * 0.2
+
+        self._dispatch()
+
+    def _remove(self, job: _Job):
+        """takes a job out of the line (if it was cancelled while waiting)"""
+        jobs = self._waiting[job.guild_id]
+        jobs.remove(job)
+
+        if not jobs:
+            del self._waiting[job.guild_id]
+            self._rotation.remove(job.guild_id)
+
+    async def _edit(self, job: _Job, content: str, queued: bool = False):
+        # don't show a place in line if the job started in the meantime
+        if queued and job.started.done():
+            return
+
+        try:
+            await job.message.edit(content=content)
+        except discord.HTTPException:
+            pass
+
+    async def _refresh_positions(self):
+        """keeps the "waiting" messages updated with their place in line"""
+        while self._waiting:
+            updates = []
+
+            for jobs in self._waiting.values():
+                for job in jobs:
+                    position = self._position(job)
+
+                    if position != job.shown_position:
+                        job.shown_position = position
+                        updates.append(
+                            self._edit(
+                                job,
+                                v.JOBS__QUEUED_MSG(position, self._eta(position)),
+                                queued=True,
+                            )
+                        )
+
+            await asyncio.gather(*updates)
+            await asyncio.sleep(v.JOBS__REFRESH_SECONDS)
+
+    @asynccontextmanager
+    async def job(
+        self, ctx: commands.Context, message: discord.Message, status: str = None
+    ):
+        """
+        waits for a turn to run a media job (the message shows its place in line meanwhile)
+        and `status` is what the message gets changed back to once the job starts
+        """
+        await self._check_rate(ctx.author.id, message)
+
+        job = _Job(ctx.guild.id if ctx.guild else 0, message, status)
+
+        if job.guild_id not in self._waiting:
+            self._waiting[job.guild_id] = deque()
+            self._rotation.append(job.guild_id)
+
+        self._waiting[job.guild_id].append(job)
+        self._dispatch()
+
+        if not job.started.done() and (not self._refresher or self._refresher.done()):
+            self._refresher = asyncio.create_task(self._refresh_positions())
+
+        try:
+            await job.started
+        except asyncio.CancelledError:
+            if job.started.cancelled():
+                self._remove(job)
+            else:
+                self._finish(job, None)  # it started right as it was cancelled
+
+            raise
+
+        if job.shown_position:
+            await self._edit(job, v.BOT__PROCESSING_MSG() if status is None else status)
+
+        start = monotonic()
+
+        try:
+            yield
+        finally:
+            self._finish(job, monotonic() - start)
@@ -38,6 +38,8 @@ class ImageServerKeys(BaseKey):
         self.domain = self.get("domain")
         self.secret = self.get("secret")
         self.cdn = self.get("cdn")
+        self.quota = self.get("quota")  # mb the served files can take up in total
+        self.guild_quota = self.get("guild_quota")  # mb one server's files can take up
 
 
 class OtherKeys(BaseKey):
@@ -47,6 +49,14 @@ class OtherKeys(BaseKey):
         self.gyazo = self.get("gyazo")
 
 
+class WorkerKeys(BaseKey):
+    def __init__(self):
+        super().__init__("workers")
+        self.edit = self.get("edit")  # processes for editing images/gifs
+        self.io = self.get("io")  # threads for ffmpeg and other blocking calls
+        self.download = self.get("download")  # threads for yt-dlp downloads
+
+
 @dataclass
 class Keys:
     lavalink = LavalinkKeys()
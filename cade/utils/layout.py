@@ -0,0 +1,243 @@
+from functools import lru_cache
+from itertools import islice
+from typing import Callable
+
+import numpy
+from PIL import Image, ImageFont
+
+from .vars import v
+
+
+class _Advances(dict):
+    """width of each character in a font (measured the first time it's needed)"""
+
+    def __init__(self, font: ImageFont.FreeTypeFont):
+        super().__init__()
+        self.font = font
+
+    def __missing__(self, char: str) -> float:
+        self[char] = width = self.font.getlength(char)
+        return width
+
+    def estimate(self, text: str) -> float:
+        """rough width of the text (no kerning), used to guess where lines break"""
+        return sum(self[char] for char in text)
+
+
+@lru_cache(maxsize=32)
+def get_font(size: int) -> ImageFont.FreeTypeFont:
+    """loads the caption font at the given size (only once per size)"""
+    return ImageFont.truetype(v.PIL__FONT_PATH, size, layout_engine=ImageFont.Layout.RAQM)
+
+
+@lru_cache(maxsize=32)
+def _get_advances(font: ImageFont.FreeTypeFont) -> _Advances:
+    return _Advances(font)
+
+
+def _fits(font: ImageFont.FreeTypeFont, text: str, available_width: int) -> bool:
+    """checks if the text fits in the available width, only measuring as much of it as needed"""
+    advances = _get_advances(font)
+    estimate = 0
+
+    for end, char in enumerate(text):
+        estimate += advances[char]
+
+        # if the start of a long text doesn't fit, then the whole text doesn't either
+        if estimate > available_width * 2:
+            if font.getlength(text[:end]) > available_width:
+                return False
+
+            break
+
+    return font.getlength(text) <= available_width
+
+
+def _last_fitting(count: int, fits: Callable[[int], bool], guess: int) -> int:
+    """
+    finds the largest n (0 to count) where fits(n) is true, assuming fits(0) is true
+    and that once something doesn't fit, nothing longer does either
+
+    the guess is checked first, so a good guess only costs two measurements
+    """
+    guess = min(max(guess, 0), count)
+
+    # find a range where lo fits and hi doesn't, starting from the guess
+    if guess == 0 or fits(guess):
+        lo, step = guess, 1
+
+        while (hi := lo + step) <= count and fits(hi):
+            lo, step = hi, step * 2
+
+        if hi > count:
+            hi = count + 1  # pretend the end doesn't fit
+    else:
+        hi, step = guess, 1
+
+        while (lo := hi - step) > 0 and not fits(lo):
+            hi, step = lo, step * 2
+
+        lo = max(lo, 0)
+
+    # binary search in between
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+
+        if fits(mid):
+            lo = mid
+        else:
+            hi = mid
+
+    return lo
+
+
+def _fill_line(
+    font: ImageFont.FreeTypeFont,
+    line: str,
+    words: list[str],
+    start: int,
+    available_width: int,
+) -> tuple[str, int]:
+    """adds as many words (from start) to the line as will fit, returning the new line and the next word index"""
+    advances = _get_advances(font)
+
+    # what each word adds to the line (same as stripping the line after every word)
+    pieces = []
+    has_text = bool(line)
+    estimate = advances.estimate(line)
+    guess = None
+
+    for word in islice(words, start, None):
+        if not word.strip():
+            piece = ""
+        elif has_text:
+            piece = " " + word.rstrip()
+        else:
+            piece = word.strip()
+            has_text = True
+
+        pieces.append(piece)
+        estimate += advances.estimate(piece)
+
+        # only look a little past where the line probably ends
+        if guess is None and estimate > available_width:
+            guess = len(pieces) - 1
+        elif guess is not None and len(pieces) > guess + 2:
+            break
+
+    if guess is None:
+        guess = len(pieces)
+
+    built = {0: line}
+
+    def fits(n: int) -> bool:
+        while len(pieces) < n:  # the guess was too short
+            word = words[start + len(pieces)]
+            pieces.append(" " + word.rstrip() if word.strip() else "")
+
+        built[n] = line + "".join(pieces[:n])
+        return _fits(font, built[n], available_width)
+
+    fitting = _last_fitting(len(words) - start, fits, guess)
+
+    if fitting not in built:
+        fits(fitting)
+
+    return built[fitting], start + fitting
+
+
+def _split_word(
+    font: ImageFont.FreeTypeFont, word: str, available_width: int
+) -> tuple[str, str]:
+    """splits a word that is too long for one line, giving the first part (with a hyphen) and the rest"""
+    advances = _get_advances(font)
+
+    guess, estimate = 0, advances["-"]
+
+    for char in word:
+        estimate += advances[char]
+
+        if estimate > available_width:
+            break
+
+        guess += 1
+
+    fitting = _last_fitting(
+        len(word), lambda n: _fits(font, word[:n] + "-", available_width), guess
+    )
+
+    # at least one character is always used
+    split_index = max(fitting - 1, 1)
+    partial = word[: split_index + 1] if fitting > 1 else word[:1]
+
+    return partial + "-", word[split_index + 1 :]
+
+
+def wrap_text(font: ImageFont.FreeTypeFont, text: str, width: int) -> str:
+    """wraps text to fit in a caption"""
+    available_width = width - (width // 12)
+    wrapped_lines = []
+
+    for pre_wrap_line in text.splitlines():
+        words = pre_wrap_line.split(" ")
+        word_index = 0
+
+        # each pass makes one line out of the words that are left
+        while True:
+            current_line = ""
+
+            while word_index < len(words):
+                current_line, word_index = _fill_line(
+                    font, current_line, words, word_index, available_width
+                )
+
+                # stop at the first word that doesn't fit, unless the line is empty
+                # (then the word is too long by itself and gets split by character)
+                if word_index == len(words) or current_line != "":
+                    break
+
+                current_line, words[word_index] = _split_word(
+                    font, words[word_index], available_width
+                )
+
+            wrapped_lines.append(current_line.strip())
+
+            # continue until the leftover words would be an empty line
+            words_left = len(words) - word_index
+
+            if words_left == 0 or (words_left == 1 and not words[word_index]):
+                break
+
+    return "\n".join(wrapped_lines)
+
+
+def find_caption_end(frame: Image.Image) -> int | None:
+    """
+    finds where a caption ends using the rows of a thin grayscale copy of the frame, where rows that
+    match the caption's background (the top row) are blank and the content is the tallest stretch of
+    rows that aren't (like the largest shape before)
+    """
+    columns = min(frame.width, v.UNCAPTION__COLUMNS)
+    small = frame.resize((columns, frame.height), Image.Resampling.NEAREST).convert("L")
+    rows = numpy.asarray(small, dtype=numpy.int16)
+
+    background = int(numpy.median(rows[0]))
+
+    if background < v.UNCAPTION__WHITE:
+        return 0  # captions start with white space
+
+    # light content (like sky or a white ui) still isn't close enough to count as background
+    matches = numpy.abs(rows - background) <= v.UNCAPTION__TOLERANCE
+    blank = matches.mean(axis=1) >= v.UNCAPTION__BLANK_ROW
+
+    if blank.all():
+        return None  # nothing to go off of (like a white flash)
+
+    if not blank[0]:
+        return 0
+
+    # where each stretch of non-blank rows starts and ends
+    edges = numpy.diff(numpy.concatenate(([0], ~blank, [0])).astype(numpy.int8))
+    starts, ends = numpy.flatnonzero(edges == 1), numpy.flatnonzero(edges == -1)
+
+    return int(starts[numpy.argmax(ends - starts)])
@@ -0,0 +1,112 @@
+import json
+from queue import Empty, Queue
+from shlex import split
+from subprocess import PIPE, Popen
+from threading import Thread
+from typing import Callable, Iterable, Iterator
+
+import numpy
+
+from .vars import v
+
+
+def display_size(probe: str) -> tuple[int, int] | None:
+    """
+    gets the size that ffmpeg decodes frames at from the output of FF__GET_DIMENSIONS
+    (ffmpeg turns videos with rotation metadata, like ones from phones, while decoding)
+    """
+    try:
+        stream = json.loads(probe)["streams"][0]
+        width, height = stream["width"], stream["height"]
+    except (ValueError, KeyError, IndexError):
+        return None
+
+    # newer ffmpeg versions give the rotation as side data, older ones as a tag
+    rotation = stream.get("tags", {}).get("rotate", 0)
+
+    for side_data in stream.get("side_data_list", []):
+        rotation = side_data.get("rotation", rotation)
+
+    if round(float(rotation)) % 180:  # turned sideways
+        width, height = height, width
+
+    return width, height
+
+
+class FramePipe:
+    """
+    streams a video through python as numpy frames using two ffmpeg processes
+    (decoder -> function -> encoder), keeping at most `budget` frames in memory
+    """
+
+    def __init__(self, path: str, size: tuple[int, int], fps: str, budget: int = v.PIPE__FRAME_BUDGET):
+        self.path = path  # directory containing input.mp4
+        self.width, self.height = size
+        self.fps = fps
+        self.budget = budget
+
+    def _read_frames(self, decoder: Popen, frames: Queue):
+        """reads raw frames from the decoder (blocks while the queue is full)"""
+        try:
+            while True:
+                frame = numpy.empty((self.height, self.width, 3), numpy.uint8)
+
+                if decoder.stdout.readinto(memoryview(frame).cast("B")) < frame.nbytes:
+                    break
+
+                frames.put(frame)
+        finally:
+            frames.put(None)
+
+    def frames(self) -> Iterator[numpy.ndarray]:
+        """yields every frame of the video as a (height, width, 3) array"""
+        decoder = Popen(split(v.FF__DECODE_RAW(self.path, v.PIPE__PIXEL_FORMAT)), stdout=PIPE)
+        frames = Queue(maxsize=self.budget)
+
+        reader = Thread(target=self._read_frames, args=(decoder, frames), daemon=True)
+        reader.start()
+
+        try:
+            while (frame := frames.get()) is not None:
+                yield frame
+        finally:
+            # stop decoding if the frames aren't needed anymore
+            if decoder.poll() is None:
+                decoder.kill()
+
+            # unblock the reader if it's stuck on a full queue
+            while reader.is_alive():
+                try:
+                    frames.get_nowait()
+                except Empty:
+                    reader.join(0.05)
+
+            decoder.stdout.close()
+            decoder.wait()
+
+    def encode(self, frames: Iterable[numpy.ndarray]) -> int:
+        """encodes frames into output.mp4 (with the original audio) and returns the exit code"""
+        encoder = None
+
+        try:
+            for frame in frames:
+                # the output size comes from the first processed frame
+                if encoder is None:
+                    height, width = frame.shape[:2]
+                    encoder = Popen(
+                        split(v.FF__ENCODE_RAW(self.path, v.PIPE__PIXEL_FORMAT, width, height, self.fps)),
+                        stdin=PIPE,
+                    )
+
+                encoder.stdin.write(numpy.ascontiguousarray(frame, numpy.uint8).data)
+        except BrokenPipeError:
+            pass  # encoder failed, its exit code is returned below
+        finally:
+            if encoder:
+                encoder.stdin.close()
+
+        return encoder.wait() if encoder else 1
+
+    def run(self, function: Callable[[numpy.ndarray], numpy.ndarray]) -> int:
+        """runs a function on every frame and encodes the results"""
+        return self.encode(map(function, self.frames()))
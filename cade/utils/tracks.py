@@ -1,5 +1,4 @@
 from dataclasses import dataclass
-from aiohttp import ClientSession
 
 import discord
 from lavalink import (
@@ -10,11 +9,11 @@ from lavalink import (
 )
 
 from .base import BaseEmbed, CadeElegy
+from . import web
+from .colors import get_artwork_color
 from .useful import (
     format_time,
     Pages,
-    get_average_color,
-    read_from_url,
     get_artwork_url,
 )
 from .vars import v
@@ -72,16 +71,16 @@ async def get_youtube(client: CadeElegy, query: str, return_all: bool = False):
 async def _get_lyrics(track: AudioTrack):
     ll_keys = LavalinkKeys()
 
-    async with ClientSession(headers={"Authorization": ll_keys.secret}) as session:
-        async with session.get(
-            f"http://{ll_keys.host}:{ll_keys.port}/v4/lyrics?track={track.raw['encoded']}"
-        ) as resp:
-            status = resp.status
-            try:
-                resp = await resp.json()
-            except:
-                status = 0
-                resp = None
+    async with web.shared.get(
+        f"http://{ll_keys.host}:{ll_keys.port}/v4/lyrics?track={track.raw['encoded']}",
+        headers={"Authorization": ll_keys.secret},
+    ) as resp:
+        status = resp.status
+        try:
+            resp = await resp.json()
+        except:
+            status = 0
+            resp = None
 
     return status, resp
 
@@ -97,17 +96,11 @@ async def get_np_lyrics(player: DefaultPlayer):
     embeds: list[BaseEmbed] = []
 
     total_pages = int(math.ceil(len(lyrics) / 25))
+    color = await get_artwork_color(get_artwork_url(track))
 
     for i, line in enumerate(lyrics):
         if i % v.MUSIC__LYRIC_MAX_LINES == 0:
-            yt_image_bytes = (await read_from_url(get_artwork_url(track)))[1]
-            average_color = get_average_color(yt_image_bytes)
-
-            new_embed = BaseEmbed(
-                title=track.title,
-                description="",
-                color=discord.Color.from_rgb(*average_color),
-            )
+            new_embed = BaseEmbed(title=track.title, description="", color=color)
             new_embed.set_footer(
                 text=f"({math.ceil((i + 1) / v.MUSIC__LYRIC_MAX_LINES)} / {total_pages}) • from {resp['sourceName']}"
             )
@@ -1,35 +1,81 @@
 import asyncio
 from dataclasses import dataclass
-from functools import partial
+from functools import partial, wraps
+from hashlib import sha256
 from io import BytesIO
+from os import SEEK_END
 from os.path import splitext
 from shlex import split
 from subprocess import PIPE, Popen
+from tempfile import SpooledTemporaryFile
 from time import gmtime, strftime
-import sys
+from typing import IO, Awaitable, Callable
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 
 import aiohttp
 import discord
-import numpy as np
 from discord.ext import commands, menus
+from discord.utils import DEFAULT_FILE_SIZE_LIMIT_BYTES
 from PIL import Image
 
+from . import web, workers
 from .base import CadeElegy
+from .cache import TieredCache
 from .db import GuildDB
 from .ext import serve_very_big_file
+from .fit import fit_under
 from .keys import Keys
 from .vars import v
 
 from lavalink import AudioTrack
 
 
+class SpooledFile(SpooledTemporaryFile):
+    """a file that's kept in memory until it gets too big, then moved to disk"""
+
+    def __init__(self, max_size: int = v.MEDIA__SPOOL_BYTES):
+        super().__init__(max_size)
+
+    def getvalue(self) -> bytes:
+        position = self.tell()
+        self.seek(0)
+
+        try:
+            return self.read()
+        finally:
+            self.seek(position)
+
+    def __reduce__(self):
+        # sent to worker processes as a plain file in memory
+        return BytesIO, (self.getvalue(),)
+
+
+# downloads only time out if they stop getting data, since big files on slow links can take a while
+_MEDIA_TIMEOUT = aiohttp.ClientTimeout(
+    total=None, sock_connect=v.WEB__CONNECT_TIMEOUT, sock_read=v.WEB__READ_TIMEOUT
+)
+
+
+class MediaTooBig(Exception):
+    """raised when a download goes over v.MEDIA__MAX_DOWNLOAD_BYTES"""
+
+
 @dataclass
 class AttObj:
-    filebyte: BytesIO
+    filebyte: BytesIO | SpooledFile
     filename: str
     filetype: str
 
 
+# files that were downloaded recently, so editing the same one again skips the download
+_inputs = TieredCache(
+    v.CACHE__INPUT_MEMORY_BYTES,
+    v.CACHE__INPUT_PATH,
+    v.CACHE__INPUT_DISK_BYTES,
+    v.CACHE__INPUT_TTL,
+)
+
+
 class Pages(menus.ListPageSource):
     def __init__(self, data):
         super().__init__(data, per_page=1)
@@ -48,21 +94,44 @@ def get_media_kind(mime: str):
             return "video"
 
 
+async def _download(r: aiohttp.ClientResponse, size: int = None) -> SpooledFile:
+    """reads a response in chunks, stopping early if it's too big (size is how big it should be)"""
+    size = size or r.content_length
+
+    if size and size > v.MEDIA__MAX_DOWNLOAD_BYTES:
+        raise MediaTooBig()
+
+    file = SpooledFile()
+
+    try:
+        async for chunk in r.content.iter_chunked(v.MEDIA__CHUNK_BYTES):
+            # the size can be missing or wrong, so it's checked while reading too
+            if file.tell() + len(chunk) > v.MEDIA__MAX_DOWNLOAD_BYTES:
+                raise MediaTooBig()
+
+            file.write(chunk)
+    except BaseException:
+        file.close()
+        raise
+
+    file.seek(0)
+    return file
+
+
 async def read_from_url(url: str):
-    r_bytes: bytes = None
+    r_file: SpooledFile = None
     r_json: dict = {}
 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url) as r:
-            if get_media_kind(r.content_type) in ["image", "gif", "video"]:
-                r_bytes = await r.read()
-            else:
-                try:
-                    r_json = await r.json()
-                except aiohttp.ContentTypeError:
-                    r_json = {"text": await r.text()}
+    async with web.shared.get(url, timeout=_MEDIA_TIMEOUT) as r:
+        if get_media_kind(r.content_type) in ["image", "gif", "video"]:
+            r_file = await _download(r)
+        else:
+            try:
+                r_json = await r.json()
+            except aiohttp.ContentTypeError:
+                r_json = {"text": await r.text()}
 
-            return r, r_bytes, r_json
+        return r, r_file, r_json
 
 
 async def _link_bytes(
@@ -99,17 +168,87 @@ async def _link_bytes(
         link = f"{Keys.image.cdn}/{link}"
 
     # try reading bytes from the link
-    r, r_bytes, r_json = await read_from_url(link)
+    try:
+        r, r_file, r_json = await read_from_url(link)
+    except MediaTooBig:
+        return None, v.ERR__MEDIA_TOO_BIG
 
     if r_json and r_json["text"] == "This content is no longer available.":
         return None, v.ERR__CDN_EXPIRED
 
     if get_media_kind(r.content_type) in media_types:
-        return AttObj(BytesIO(r_bytes), "url", r.content_type), None
+        return AttObj(r_file, "url", r.content_type), None
     else:
         return None, v.ERR__WRONG_ATT_TYPE
 
 
+def _normalize_url(url: str) -> str:
+    """makes links to the same file look the same"""
+    parts = urlsplit(url)
+    query = sorted(
+        (key, value)
+        for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key not in v.CACHE__SIGNED_URL_PARAMS
+    )
+
+    return urlunsplit(
+        (
+            parts.scheme.lower(),
+            parts.netloc.lower(),
+            parts.path.rstrip("/"),
+            urlencode(query),
+            "",
+        )
+    )
+
+
+async def _cached_media(
+    key: str,
+    media_types: list[str],
+    fetch: Callable[[], Awaitable[tuple[AttObj | None, str | None]]],
+) -> tuple[AttObj | None, str | None]:
+    """gets media from the cache if it was downloaded recently (and is small enough to keep), otherwise downloads it"""
+    key = sha256(key.encode()).hexdigest()
+
+    if item := await _inputs.get(key):
+        data, filename, filetype = item
+
+        if get_media_kind(filetype) not in media_types:
+            return None, v.ERR__WRONG_ATT_TYPE
+
+        return AttObj(BytesIO(data), filename, filetype), None
+
+    try:
+        att_obj, error = await fetch()
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        return None, v.ERR__DOWNLOAD_FAILED
+
+    # bigger files were spooled to disk while downloading, and caching them would read them back into memory
+    if att_obj and _file_size(att_obj.filebyte) <= v.MEDIA__SPOOL_BYTES:
+        await _inputs.set(
+            key, (att_obj.filebyte.getvalue(), att_obj.filename, att_obj.filetype)
+        )
+
+    return att_obj, error
+
+
+async def _attachment_bytes(
+    att: discord.Attachment,
+) -> tuple[AttObj | None, str | None]:
+    if att.size > v.MEDIA__MAX_DOWNLOAD_BYTES:  # checked before downloading anything
+        return None, v.ERR__MEDIA_TOO_BIG
+
+    async with web.shared.get(att.url, timeout=_MEDIA_TIMEOUT) as r:
+        r.raise_for_status()
+
+        try:
+            file = await _download(r, att.size)
+        except MediaTooBig:
+            return None, v.ERR__MEDIA_TOO_BIG
+
+    return AttObj(file, splitext(att.filename)[0], att.content_type), None
+
+
 async def get_media(
     ctx: commands.Context, media_types: list[str]
 ) -> tuple[AttObj | None, str | None]:
@@ -132,8 +271,8 @@ async def get_media(
         att = msg.attachments[0]
 
         if get_media_kind(att.content_type) in media_types:
-            att_obj = AttObj(
-                BytesIO(await att.read()), splitext(att.filename)[0], att.content_type
+            att_obj, error = await _cached_media(
+                f"attachment:{att.id}", media_types, partial(_attachment_bytes, att)
             )
         else:
             error = v.ERR__WRONG_ATT_TYPE
@@ -141,7 +280,11 @@ async def get_media(
         link = match.group(0)
 
         if link.startswith((Keys.image.domain, *v.BOT__SUPPORTED_SITES)):
-            att_obj, error = await _link_bytes(link, media_types)
+            att_obj, error = await _cached_media(
+                f"url:{_normalize_url(link)}",
+                media_types,
+                partial(_link_bytes, link, media_types),
+            )
         else:
             error = v.ERR__UNSUPPORTED_URL
     else:  # if nothing was found
@@ -193,13 +336,16 @@ def format_time(sec: int = 0, ms: int = 0):
     return strftime(format, gmtime(sec))
 
 
-def get_average_color(image: bytes):
-    """gets the average color of an image (from bytes)"""
-    pil_img = Image.open(BytesIO(image))
-    np_img = np.array(pil_img)
+def get_average_color(image: IO[bytes]):
+    """gets the average color of an image (from a file)"""
+    pil_img = Image.open(image)
 
-    average_color = [round(x) for x in np_img.mean(axis=0).mean(axis=0)]
-    return average_color
+    # jpegs can be decoded at a fraction of their size, which barely changes the average
+    pil_img.draft("RGB", (v.ARTWORK__SAMPLE_SIZE, v.ARTWORK__SAMPLE_SIZE))
+
+    # shrinking to one pixel averages all of them
+    pixel = pil_img.convert("RGB").resize((1, 1), Image.Resampling.BOX)
+    return list(pixel.getpixel((0, 0)))
 
 def get_attachment_obj(ctx: commands.Context):
     """gets the attachment object from a message"""
@@ -221,11 +367,15 @@ def get_artwork_url(track: AudioTrack):
     return track.raw["albumArtUrl"] if not track.artwork_url else track.artwork_url
 
 
-def run_async(func):
+def run_async(func: Callable = None, *, pool: str = "io"):
+    """runs blocking functions in async, using one of the worker pools (see workers.py)"""
+    if func is None:
+        return partial(run_async, pool=pool)
+
+    @wraps(func)
     async def wrapper(*args, **kwargs):
-        """runs blocking functions in async"""
-        loop = asyncio.get_running_loop()
-        return await loop.run_in_executor(None, partial(func, *args, **kwargs))
+        # looked up when called so reloading utils doesn't leave old pools behind
+        return await getattr(workers.Workers, pool).run(func, *args, **kwargs)
 
     return wrapper
 
@@ -244,8 +394,47 @@ def run_cmd(
     return result, p.returncode
 
 
+def _file_size(file: IO[bytes]) -> int:
+    """how many bytes are in the file (without reading it)"""
+    file.seek(0, SEEK_END)
+    size = file.tell()
+    file.seek(0)
+
+    return size
+
+
+def _upload_limit(ctx: commands.Context) -> int:
+    # boosted servers allow bigger files
+    return ctx.guild.filesize_limit if ctx.guild else DEFAULT_FILE_SIZE_LIMIT_BYTES
+
+
+async def fit_media(
+    ctx: commands.Context, orig_msg: discord.Message, media: tuple[IO[bytes], str, str]
+) -> tuple[IO[bytes], str, str]:
+    """
+    shrinks media that's too big to send until it fits (if it can be), which is
+    done inside the command's job so it's limited like the rest of the edit
+    """
+    if not media[0]:
+        return media
+
+    limit = _upload_limit(ctx)
+
+    if (size := _file_size(media[0])) <= limit:
+        return media
+
+    await orig_msg.edit(content=f"-# {v.EMJ__WAITING} shrinking...")
+
+    # uploading to discord is better than the image server if it can be made small enough
+    if fitted := await fit_under(media, size, limit):
+        media[0].close()
+        return fitted
+
+    return media
+
+
 async def send_media(
-    ctx: commands.Context, orig_msg: discord.Message, media: tuple[BytesIO, str, str]
+    ctx: commands.Context, orig_msg: discord.Message, media: tuple[IO[bytes], str, str]
 ):
     """sends the given media to discord or the image server depending on its size"""
     await orig_msg.edit(content=f"-# {v.EMJ__WAITING} sending...")
@@ -253,16 +442,27 @@ async def send_media(
     if not media[0]:  # if the edited file is missing (could not be made)
         await orig_msg.edit(content=v.ERR__MEDIA_EDIT_ERROR)
         return
-    elif (sys.getsizeof(media[0]) / v.DISCORD__MAX_FILESIZE_BYTES) >= v.DISCORD__MAX_FILESIZE_MB:
+
+    limit = _upload_limit(ctx)
+    limit_mb = limit // 2**20
+
+    size = _file_size(media[0])
+
+    if size > limit:
         if Keys.image.domain:
-            url = await serve_very_big_file(ctx.guild.id, media)
-            await ctx.reply(f"-# uploaded to {Keys.image.domain.replace('https://', '')} (larger than 10 mb), deletes in 24 hrs!!\n{url}")
+            if not (url := await serve_very_big_file(ctx.guild.id, media)):
+                await orig_msg.edit(content=v.ERR__FILE_TOO_BIG(limit_mb))
+                return
+
+            await ctx.reply(f"-# uploaded to {Keys.image.domain.replace('https://', '')} (larger than {limit_mb} mb), deletes in 24 hrs!!\n{url}")
             return
         else:
-            await orig_msg.edit(content=v.ERR__FILE_TOO_BIG)
+            media[0].close()
+            await orig_msg.edit(content=v.ERR__FILE_TOO_BIG(limit_mb))
             return
 
     try:
+        # the file is streamed from where it is (discord.File closes it afterwards)
         await ctx.reply(file=discord.File(*media[:2]), mention_author=False)
     except discord.HTTPException:
         await orig_msg.edit(content=v.ERR__CANT_SEND_FILE)
@@ -38,13 +38,84 @@ class v:
     CAPTION__EMJ_OFFSET_X = 12
     CAPTION__EMJ_OFFSET_Y = CAPTION__EMJ_OFFSET_X // 2
 
+    PIPE__FRAME_BUDGET = 8  # most decoded frames waiting to be processed at once
+    PIPE__PIXEL_FORMAT = "bgr24"  # same channel order as cv2
+
+    JOBS__MAX_RUNNING = 4  # media jobs running at once
+    JOBS__MAX_PER_GUILD = 2  # media jobs running at once in one server
+    JOBS__USER_RATE = 1 / 8  # how many media commands a user gets back per second
+    JOBS__USER_BURST = 4  # media commands a user can run back to back
+    JOBS__MAX_BUCKETS = 1000
+    JOBS__FIRST_ESTIMATE = 5.0  # seconds a job is guessed to take before any have finished
+    JOBS__REFRESH_SECONDS = 3
+
+    CACHE__CAPTION_HEADER_BYTES = 32 * 2**20
+    CACHE__RESULT_MEMORY_BYTES = 128 * 2**20
+    CACHE__RESULT_DISK_BYTES = 2 * 2**30
+    CACHE__RESULT_PATH = "cache/results"
+    CACHE__RESULT_MAX_ITEM_BYTES = 16 * 2**20  # bigger results aren't kept
+    CACHE__RESULT_VERSION = 4  # bump when edits change so old results aren't used
+    CACHE__INPUT_MEMORY_BYTES = 128 * 2**20
+    CACHE__INPUT_DISK_BYTES = 1 * 2**30
+    CACHE__INPUT_PATH = "cache/inputs"
+    CACHE__INPUT_TTL = 15 * 60  # seconds a downloaded file is kept for
+    CACHE__SIGNED_URL_PARAMS = ("ex", "is", "hm")  # change every time discord gives out a link
+
+    UNCAPTION__SAMPLE_POINTS = (0.1, 0.3, 0.5, 0.7, 0.9)  # where to look for captions
+    UNCAPTION__COLUMNS = 128  # columns of each row that are checked
+    UNCAPTION__WHITE = 250  # caption backgrounds are at least this bright (in grayscale)
+    UNCAPTION__TOLERANCE = 3  # how far a pixel can be from the caption background and still match it
+    UNCAPTION__BLANK_ROW = 0.98  # rows with this much of the caption background are blank
+
+    CHAIN__MAX_STEPS = 5
+    CHAIN__SEPARATOR = "|"
+
+    GIF__MIN_DELAY = 2  # in centiseconds (anything shorter gets slowed down by most viewers)
+    GIF__FFMPEG_PIXELS = 50_000_000  # gifs with more pixels than this (frames * width * height) use ffmpeg
+
+    FIT__MARGIN = 0.97  # how close to the upload limit a shrunk file aims for
+    FIT__GOOD_ENOUGH = 0.85  # a shrunk gif this close to the target isn't tried again
+    FIT__GIF_ATTEMPTS = 4
+    FIT__GIF_STEPS = (1, 2, 3)  # keep every nth frame
+    FIT__GIF_SCALES = (1.0, 0.95, 0.9, 0.85, 0.8, 0.7, 0.6, 0.5, 0.4, 0.3)
+    FIT__GIF_COLORS = (256, 128, 64, 32)
+    FIT__AUDIO_KBPS = 96
+    FIT__MIN_VIDEO_KBPS = 150  # anything lower looks too bad to bother with
+    FIT__VIDEO_HEIGHTS = ((2500, 1080), (1200, 720), (600, 480), (0, 360))  # (kbps, max height)
+
     HTML__OK_STATUS = 200
 
+    LARGEFILES__PATH = "largefiles"  # served by the image server
+    LARGEFILES__STORE = "largefiles/objects"  # each file once, named by its hash
+    LARGEFILES__COLLECTION = "largefiles"
+    LARGEFILES__QUOTA = 10 * 2**30  # total size of served files, unless set in config.ini
+    LARGEFILES__TTL = 24 * 60 * 60  # seconds a file is served for
+    LARGEFILES__TTL_SLACK = 60 * 60  # extra time before mongo drops entries that weren't cleaned up
+    LARGEFILES__GRACE = 10 * 60  # files newer than this are never treated as orphaned (they might not be in the database yet)
+
+    COUNTS__FLUSH_SECONDS = 60  # how often command counts are saved to the database
+
+    MEDIA__MAX_DOWNLOAD_BYTES = 100 * 2**20  # anything bigger isn't downloaded
+    MEDIA__SPOOL_BYTES = 16 * 2**20  # downloads bigger than this are kept on disk
+    MEDIA__CHUNK_BYTES = 256 * 2**10
+
+    WEB__TIMEOUT = 60  # seconds for a whole request
+    WEB__CONNECT_TIMEOUT = 10
+    WEB__READ_TIMEOUT = 30  # seconds a download can go without getting anything (big files have no total limit)
+    WEB__MAX_CONNECTIONS = 100
+    WEB__MAX_PER_HOST = 10
+    WEB__DNS_TTL = 300  # seconds dns lookups are kept for
+    WEB__KEEPALIVE = 30  # seconds an unused connection stays open
+    WEB__RETRIES = 2
+    WEB__RETRY_DELAY = 0.5  # seconds before the first retry (doubles every time)
+    WEB__RETRY_STATUSES = (429, 500, 502, 503, 504)
+
     MUSIC__LYRIC_MAX_LINES = 24
     MUSIC__QUEUE_MAX_LINES = 10
 
-    DISCORD__MAX_FILESIZE_BYTES = 10**6
-    DISCORD__MAX_FILESIZE_MB = 10
+    ARTWORK__SAMPLE_SIZE = 64  # artwork is shrunk to about this size before averaging
+    ARTWORK__CACHED_COLORS = 512
+
     DISCORD__LATENCY_DEC_PLACES = 3
 
     MATH__MS_MULTIPLIER = 1000
@@ -52,6 +123,7 @@ class v:
     PIL__FONT_PATH = "fonts/futura.ttf"
     PIL__WHITE = (255, 255, 255)
     PIL__BLACK = (0, 0, 0)
+    PIL__REDUCING_GAP = 2.0  # how much bigger than the target size an image is shrunk to first (quickly)
 
     BOT__CADE_THEME = 0xEAC597
     BOT__PLAYING_TRACK_THEME = 0x4287F5
@@ -120,6 +192,9 @@ class v:
             f"{P} (cade now loading)",
         ]
     )
+    JOBS__QUEUED_MSG = lambda pos, eta, W=EMJ__WAITING: (
+        f"-# {W} waiting in line... (#{pos}, about {eta}s)"
+    )
     
     RE__YOUTUBE = re.compile(
         r"https?:\/\/(?:youtu\.be\/|(?:www\.|m\.)?youtube\.com\/(watch|v|embed|shorts|playlist)?(?:\.php)?(?:\?(?:v=|list=)|\/))([a-zA-Z0-9\_-]+)"
@@ -136,13 +211,65 @@ class v:
     RE__DISCORD_EMOJI = re.compile(r"<\:\w*\:\w*>")
     RE__DE_PLACEHOLDER = re.compile(r"\[#[0-9]#\]")
     
-    FF__GET_DIMENSIONS = f"{__FFPROBE} -select_streams v -show_entries stream=width,height -of csv=p=0:s=x -"
+    FF__GET_DIMENSIONS = f"{__FFPROBE} -select_streams v:0 -show_entries stream=width,height:stream_tags=rotate:stream_side_data=rotation -of json -"
     FF__GET_DURATION = f"{__FFPROBE} -show_entries format=duration -of default=noprint_wrappers=1:nokey=1 -"
     FF__GET_STREAM = lambda path, url, ext, start, end, FF=__FFMPEG: (
         FF + (f"-ss {start} -to {end} " if start else "") + f"-i {url} {path}/output.{ext}"
     )
-    FF__CREATE_MP4 = lambda path, fps, FF=__FFMPEG, PD=__FF__PAD_EVEN: (
-        f"{FF} -framerate {fps} -i '{path}/%d.png' -vn -i {path}/input.mp4 -c:v libx264 -pix_fmt yuv420p {PD} {path}/output.mp4"
+    FF__PROBE_DURATION = lambda input, FP=__FFPROBE: (
+        f"{FP} -show_entries format=duration -of default=noprint_wrappers=1:nokey=1 {input}"
+    )
+    FF__GET_FPS = f"{__FFPROBE} -select_streams v -show_entries stream=r_frame_rate -of csv=p=0 -"
+    FF__DECODE_RAW = lambda path, fmt, FF=__FFMPEG: (
+        f"{FF} -i {path}/input.mp4 -map 0:v:0 -f rawvideo -pix_fmt {fmt} -"
+    )
+    FF__ENCODE_RAW = lambda path, fmt, width, height, fps, FF=__FFMPEG, PD=__FF__PAD_EVEN: (
+        f"{FF} -f rawvideo -pix_fmt {fmt} -s {width}x{height} -r {fps} -i - -i {path}/input.mp4 "
+        f"-map 0:v -map 1:a? -c:v libx264 -pix_fmt yuv420p {PD} -c:a aac {path}/output.mp4"
+    )
+    FF__CAPTION = lambda path, height, FF=__FFMPEG: (
+        f"{FF} -i {path}/input.mp4 -i {path}/caption.png -filter_complex "
+        f"'[0:v]pad=width=ceil(iw/2)*2:height=ceil((ih+{height})/2)*2:y={height}:color=white[v];[v][1:v]overlay,format=yuv420p[out]' "
+        f"-map [out] -map 0:a? -c:v libx264 -c:a aac {path}/output.mp4"
+    )
+    FF__CHAIN = lambda path, inputs, video_filter, audio_filter, FF=__FFMPEG: (
+        f"{FF} -i {path}/input.mp4 {inputs} -filter_complex '[0:v]{video_filter},pad=ceil(iw/2)*2:ceil(ih/2)*2,format=yuv420p[out]' "
+        f"-map [out] -map 0:a? -c:v libx264 " + (f"-af {audio_filter} " if audio_filter else "-c:a aac ") + f"{path}/output.mp4"
+    )
+    FF__GIF_FRAMES = lambda path, FF=__FFMPEG: (
+        f"{FF} -i {path}/input.gif -fps_mode passthrough -compression_level 1 {path}/frame%06d.png"
+    )
+    FF__GIF_SAMPLES = lambda path, indexes, FF=__FFMPEG: (
+        f"{FF} -i {path}/input.gif -vf \"select='{'+'.join(f'eq(n,{i})' for i in indexes)}'\" "
+        f"-fps_mode passthrough -compression_level 1 {path}/sample%02d.png"
+    )
+    FF__GIF_EDIT = lambda path, input, inputs, video_filter, FF=__FFMPEG: (
+        f"{FF} {input} {inputs} -filter_complex '[0:v]{video_filter},split[a][b];"
+        f"[a]palettegen=stats_mode=single[p];[b][p]paletteuse=new=1:dither=none' "
+        f"-fps_mode passthrough -loop 0 {path}/output.gif"
+    )
+    FF__FIT_GIF = lambda path, input, step, scale, colors, FF=__FFMPEG: (
+        f"{FF} -i {input} -filter_complex \"[0:v]select='not(mod(n,{step}))',scale=iw*{scale}:-1:flags=bicubic,split[a][b];"
+        f"[a]palettegen=max_colors={colors}:stats_mode=diff[p];[b][p]paletteuse=dither=none\" "
+        f"-fps_mode passthrough -loop 0 {path}/output.gif"
+    )
+    FF__FIT_VIDEO = lambda path, input, height, kbps, audio_kbps, FF=__FFMPEG: (
+        f"{FF} -i {input} -vf \"scale=-2:'trunc(min(ih,{height})/2)*2'\" -c:v libx264 -preset fast "
+        f"-b:v {kbps}k -maxrate {kbps}k -bufsize {kbps}k -pix_fmt yuv420p "
+        f"-c:a aac -b:a {audio_kbps}k -movflags +faststart {path}/output.mp4"
+    )
+    FF__FIT_VIDEO_PASSES = lambda path, input, height, kbps, audio_kbps, FF=__FFMPEG: (
+        f"{FF} -i {input} -vf \"scale=-2:'trunc(min(ih,{height})/2)*2'\" -c:v libx264 -preset fast "
+        f"-b:v {kbps}k -pix_fmt yuv420p -pass 1 -passlogfile {path}/pass -an -f null /dev/null",
+        f"{FF} -i {input} -vf \"scale=-2:'trunc(min(ih,{height})/2)*2'\" -c:v libx264 -preset fast "
+        f"-b:v {kbps}k -pix_fmt yuv420p -pass 2 -passlogfile {path}/pass "
+        f"-c:a aac -b:a {audio_kbps}k -movflags +faststart {path}/output.mp4",
+    )
+    FF__GET_FRAME = lambda path, time, FF=__FFMPEG: (
+        f"{FF} -ss {time} -i {path}/input.mp4 -frames:v 1 -f image2pipe -c:v png -"
+    )
+    FF__CROP = lambda path, y, FF=__FFMPEG: (
+        f"{FF} -i {path}/input.mp4 -vf crop=floor(iw/2)*2:floor((ih-{y})/2)*2:0:{y} -c:v libx264 -pix_fmt yuv420p -c:a aac {path}/output.mp4"
     )
     FF__RESIZE = lambda path, width, height, FF=__FFMPEG: (
         f"{FF} -i {path}/input.mp4 -vf scale={width}:{height} {path}/output.mp4"
@@ -170,7 +297,9 @@ class v:
     ERR__TAG_ALREADY_EXISTS = f"{E} that tag already exists"
     ERR__NO_TAGS_AT_ALL = f"{E} no tags have been made yet"
     ERR__CANT_SEND_FILE = f"{E} could not send the file?? (maybe try again)"
-    ERR__FILE_TOO_BIG = f"{E} the file was too big (over 10 mb)"
+    ERR__FILE_TOO_BIG = lambda mb, E=E: f"{E} the file was too big (over {mb} mb)"
+    ERR__MEDIA_TOO_BIG = f"{E} that file is too big to edit (over {MEDIA__MAX_DOWNLOAD_BYTES // 2**20} mb)"
+    ERR__DOWNLOAD_FAILED = f"{E} couldn't download that file (try again?)"
     ERR__IMAGE_SERVER_ERROR = (
         f"{E} can't find image server (not your fault i need to fix this)"
     )
@@ -188,9 +317,15 @@ class v:
     )
     ERR__INVALID_URL = f"{E} invalid url"
     ERR__INVALID_TIMESTAMP = f"{E} invalid timestamp (must be min:sec, hr:min:sec, or sec)"
+    ERR__RATE_LIMITED = lambda s, E=E: f"{E} slow down!! try again in {s}s"
     ERR__INVALID_MULTIPLIER = (
         f"{E} invalid multiplier (should be something like 2x, 1.5, etc.)"
     )
+    ERR__INVALID_EDIT = lambda e, E=E: (
+        f"{E} `{e}` isn't a valid edit (use caption, uncaption, resize, speed, reverse, or jpeg)"
+    )
+    ERR__TOO_MANY_EDITS = f"{E} too many edits (max: {CHAIN__MAX_STEPS})"
+    ERR__MIXED_EDITS = f"{E} those edits can't be done to the same file (speed is for gifs and videos, reverse is for gifs, jpeg is for images)"
     ERR__WEIRD_TIMESTAMPS = f"{E} the starting position must come before the end position"
     ERR__BOT_NOT_IN_VC = f"{E} i'm not in a vc"
     ERR__USER_NOT_IN_VC = f"{E} you're not in the vc"
@@ -5,14 +5,13 @@ from discord.ext import commands
 from lavalink import AudioTrack, DefaultPlayer
 
 from .base import BaseEmbed, CadeElegy
+from .colors import get_artwork_color, prefetch_artwork_colors
 from .tracks import QueryInfo
 from .useful import (
     btn_check,
     check,
     format_time,
-    get_average_color,
     get_artwork_url,
-    read_from_url,
 )
 from .vars import v
 
@@ -113,20 +112,22 @@ class TrackSelectView(discord.ui.View):
             get_artwork_url(self.track), self.track.title, self.track.uri
         )
 
+        # get every result's color now so going back and forth doesn't wait on downloads
+        self.prefetch = asyncio.create_task(
+            prefetch_artwork_colors([get_artwork_url(track) for track in tracks])
+        )
+
         self.set_buttons()
 
     async def interaction_check(self, interaction: discord.Interaction):
         return interaction.user == self.ctx.author
 
     async def get_track_embed(self):
-        yt_image_bytes = (await read_from_url(self.info.thumbnail))[1]
-        average_color = get_average_color(yt_image_bytes)
-
         duration = format_time(ms=self.track.duration)
 
         embed = BaseEmbed(
             description=f"**[{self.info.title}]({self.info.url})**\n`{duration}` • by **{self.track.author}**",
-            color=discord.Color.from_rgb(*average_color),
+            color=await get_artwork_color(self.info.thumbnail),
         )
 
         embed.set_author(
@@ -223,12 +224,10 @@ class NowPlayingView(discord.ui.View):
 
         # get average color of thumbnail
         art_url = get_artwork_url(track)
-        yt_image_bytes = (await read_from_url(art_url))[1]
-        average_color = get_average_color(yt_image_bytes)
 
         embed = discord.Embed(
             description=f"-# Currently Playing\n**[{track.title}]({track.uri})**\n{progress_bar}\n-# `{duration}` • by **{track.author}** • {requester.mention}",
-            color=discord.Color.from_rgb(*average_color),
+            color=await get_artwork_color(art_url),
         )
 
         embed.set_thumbnail(url=art_url)
@@ -0,0 +1,112 @@
+import asyncio
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from time import monotonic
+from typing import AsyncIterator
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from .vars import v
+
+
+class _HostStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.avg_latency = None  # seconds until the response headers come in
+
+    def add(self, latency: float, error: bool):
+        self.requests += 1
+        self.errors += error
+
+        if self.avg_latency is None:
+            self.avg_latency = latency
+        else:
+            self.avg_latency = self.avg_latency * 0.8 + latency * 0.2
+
+    @property
+    def stats(self) -> dict[str, int | float]:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "retries": self.retries,
+            "avg_latency": round(self.avg_latency or 0, 3),
+        }
+
+
+class WebClient:
+    """
+    one session for every web request the bot makes, so connections (and dns lookups)
+    get reused, with timeouts and retries for requests that fail
+    """
+
+    def __init__(self):
+        self._session: aiohttp.ClientSession = None
+        self._hosts: dict[str, _HostStats] = defaultdict(_HostStats)
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        # made when first used so it's on the bot's event loop
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=v.WEB__MAX_CONNECTIONS,
+                    limit_per_host=v.WEB__MAX_PER_HOST,
+                    ttl_dns_cache=v.WEB__DNS_TTL,
+                    keepalive_timeout=v.WEB__KEEPALIVE,
+                ),
+                timeout=aiohttp.ClientTimeout(
+                    total=v.WEB__TIMEOUT, sock_connect=v.WEB__CONNECT_TIMEOUT
+                ),
+            )
+
+        return self._session
+
+    @property
+    def stats(self) -> dict[str, dict[str, int | float]]:
+        return {host: stats.stats for host, stats in self._hosts.items()}
+
+    @asynccontextmanager
+    async def get(self, url: str, **kwargs) -> AsyncIterator[aiohttp.ClientResponse]:
+        """makes a get request, trying again a few times if it can't connect or the server has an error"""
+        stats = self._hosts[urlsplit(url).hostname]
+
+        for attempt in range(v.WEB__RETRIES + 1):
+            last_try = attempt == v.WEB__RETRIES
+            start = monotonic()
+
+            if attempt:
+                stats.retries += 1
+
+            try:
+                r = await self.session.get(url, **kwargs)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                stats.add(monotonic() - start, error=True)
+
+                if last_try:
+                    raise
+            else:
+                failed = r.status in v.WEB__RETRY_STATUSES
+                stats.add(monotonic() - start, error=failed)
+
+                if not failed or last_try:
+                    break
+
+                r.release()
+
+            await asyncio.sleep(v.WEB__RETRY_DELAY * 2**attempt)
+
+        try:
+            yield r
+        finally:
+            r.release()
+
+    async def close(self):
+        if self._session:
+            await self._session.close()
+
+
+# made once and kept when utils gets reloaded (see BaseCog), so open connections aren't lost
+shared: WebClient = globals().get("shared") or WebClient()
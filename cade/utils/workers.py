@@ -0,0 +1,150 @@
+import asyncio
+import inspect
+import multiprocessing
+import os
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from importlib import import_module
+from typing import Callable
+
+from .keys import WorkerKeys
+
+
+def _warm_up():
+    """loads the heavy editing modules once when a worker process starts"""
+    from . import edit  # noqa: F401
+    from .layout import get_font
+
+    get_font(16)  # reads the font file into the os cache
+
+
+def _call_unwrapped(module: str, qualname: str, args: tuple, kwargs: dict):
+    """runs a function inside a worker process (functions can't be sent directly if they're decorated)"""
+    func = import_module(module)
+
+    for name in qualname.split("."):
+        func = getattr(func, name)
+
+    return inspect.unwrap(func)(*args, **kwargs)
+
+
+class _Workers:
+    """a named pool of workers that keeps track of how busy it is"""
+
+    def __init__(self, name: str, size: int):
+        self.name = name
+        self.size = size
+
+        self._executor: Executor = None
+        self._pending = 0  # submitted but not finished yet
+
+    def _create(self) -> Executor: ...
+
+    def _submit(self, func: Callable, *args, **kwargs) -> Future:
+        return self.executor.submit(func, *args, **kwargs)
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            self._executor = self._create()
+
+        return self._executor
+
+    @property
+    def queued(self) -> int:
+        """jobs waiting for a free worker"""
+        return max(self._pending - self.size, 0)
+
+    @property
+    def utilization(self) -> float:
+        """how much of the pool is in use (0 to 1)"""
+        return min(self._pending, self.size) / self.size
+
+    @property
+    def stats(self) -> dict[str, int | float]:
+        return {
+            "size": self.size,
+            "active": min(self._pending, self.size),
+            "queued": self.queued,
+            "utilization": round(self.utilization, 2),
+        }
+
+    async def run(self, func: Callable, *args, **kwargs):
+        """runs a blocking function in the pool and waits for it"""
+        future = self._submit(func, *args, **kwargs)
+        self._pending += 1
+
+        try:
+            return await asyncio.wrap_future(future)
+        finally:
+            self._pending -= 1
+
+    def start(self): ...
+
+    def shutdown(self, wait: bool = False):
+        if self._executor:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+
+
+class ThreadWorkers(_Workers):
+    """threads for blocking io (like waiting on ffmpeg or downloads)"""
+
+    def _create(self):
+        return ThreadPoolExecutor(self.size, thread_name_prefix=f"cade-{self.name}")
+
+
+class ProcessWorkers(_Workers):
+    """processes for cpu-heavy work, so it isn't limited to one core by the gil"""
+
+    def _create(self):
+        return ProcessPoolExecutor(
+            self.size,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_warm_up,
+        )
+
+    def _submit(self, func: Callable, *args, **kwargs):
+        # functions are looked up by name in the worker
+        return self.executor.submit(
+            _call_unwrapped, func.__module__, func.__qualname__, args, kwargs
+        )
+
+    def start(self):
+        """starts every worker process ahead of time (instead of on the first edit)"""
+        for _ in range(self.size):
+            self.executor.submit(int)
+
+
+def _size(value: str | None, default: int) -> int:
+    return int(value) if value else default
+
+
+_keys = WorkerKeys()
+_previous = globals().get("Workers")  # set when utils gets reloaded (see BaseCog)
+
+
+class Workers:
+    """the worker pools used by the bot"""
+
+    edit = ProcessWorkers("edit", _size(_keys.edit, os.cpu_count() or 1))
+    io = ThreadWorkers("io", _size(_keys.io, 8))
+    download = ThreadWorkers("download", _size(_keys.download, 2))
+
+    @classmethod
+    def all(cls) -> list[_Workers]:
+        return [cls.edit, cls.io, cls.download]
+
+    @classmethod
+    def start(cls):
+        for workers in cls.all():
+            workers.start()
+
+    @classmethod
+    def shutdown(cls, wait: bool = False):
+        for workers in cls.all():
+            workers.shutdown(wait=wait)
+
+
+if _previous:
+    # let the old pools finish what they're doing without taking anything new
+    _previous.shutdown()
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# the bot runs from inside cade/, so its modules are imported from there
+sys.path.insert(0, str(Path(__file__).parent.parent / "cade"))
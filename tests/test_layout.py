@@ -0,0 +1,37 @@
+import numpy
+from PIL import Image
+
+from utils.layout import find_caption_end
+
+
+def _captioned(content: numpy.ndarray, caption_height: int = 100) -> Image.Image:
+    """puts a white caption with two lines of "text" above the content"""
+    caption = numpy.full((caption_height, content.shape[1]), 255, dtype=numpy.uint8)
+    caption[30:45, 40:260] = 0
+    caption[60:75, 70:230] = 0
+
+    return Image.fromarray(numpy.vstack((caption, content))).convert("RGB")
+
+
+def test_finds_caption_above_dark_content():
+    content = numpy.full((300, 300), 60, dtype=numpy.uint8)
+    assert find_caption_end(_captioned(content)) == 100
+
+
+def test_light_content_isnt_treated_as_caption():
+    rng = numpy.random.default_rng(0)
+    content = numpy.full((300, 300), 90, dtype=numpy.uint8)
+
+    # a bright sky over the top quarter of the content
+    content[:75] = rng.integers(240, 248, (75, 300), dtype=numpy.uint8)
+
+    assert find_caption_end(_captioned(content)) == 100
+
+
+def test_no_caption():
+    content = numpy.full((300, 300), 60, dtype=numpy.uint8)
+    assert find_caption_end(Image.fromarray(content)) == 0
+
+
+def test_blank_frame():
+    assert find_caption_end(Image.new("RGB", (300, 300), "white")) is None
@@ -0,0 +1,66 @@
+import json
+import shutil
+import subprocess
+from shlex import split
+
+import pytest
+
+from utils.pipe import FramePipe, display_size
+from utils.vars import v
+
+
+def _probe(stream: dict) -> str:
+    return json.dumps({"programs": [], "streams": [stream]})
+
+
+def test_display_size():
+    assert display_size(_probe({"width": 320, "height": 240})) == (320, 240)
+
+
+def test_display_size_turns_rotated_videos():
+    rotated = {"width": 320, "height": 240, "side_data_list": [{"rotation": -90}]}
+    assert display_size(_probe(rotated)) == (240, 320)
+
+    upside_down = {"width": 320, "height": 240, "side_data_list": [{"rotation": 180}]}
+    assert display_size(_probe(upside_down)) == (320, 240)
+
+
+def test_display_size_reads_old_rotate_tag():
+    assert display_size(_probe({"width": 320, "height": 240, "tags": {"rotate": "270"}})) == (240, 320)
+
+
+def test_display_size_without_video():
+    assert display_size('{"programs": [], "streams": []}') is None
+    assert display_size("") is None
+
+
+@pytest.mark.skipif(
+    not (shutil.which("ffmpeg") and shutil.which("ffprobe")), reason="needs ffmpeg"
+)
+def test_frame_pipe_reads_rotated_video(tmp_path):
+    ffmpeg = "ffmpeg -y -v error"
+    subprocess.run(
+        split(f"{ffmpeg} -f lavfi -i testsrc=s=320x240:d=0.4 -c:v libx264 -pix_fmt yuv420p {tmp_path}/plain.mp4"),
+        check=True,
+    )
+
+    # like a phone video filmed upright
+    subprocess.run(
+        split(f"{ffmpeg} -display_rotation 90 -i {tmp_path}/plain.mp4 -c copy {tmp_path}/input.mp4"),
+        check=True,
+    )
+
+    with open(f"{tmp_path}/input.mp4", "rb") as video:
+        probe = subprocess.run(split(v.FF__GET_DIMENSIONS), stdin=video, capture_output=True, text=True)
+
+    size = display_size(probe.stdout)
+    assert size == (240, 320)
+
+    shapes = []
+
+    def keep_shape(frame):
+        shapes.append(frame.shape)
+        return frame
+
+    assert FramePipe(str(tmp_path), size, "25").run(keep_shape) == 0
+    assert shapes and set(shapes) == {(320, 240, 3)}